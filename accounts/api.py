@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.http import Http404
+
+from mysite.api import JsonApiView
+from tweets.pagination import CursorPaginator
+
+from .models import FriendShip
+
+CustomUser = get_user_model()
+
+FOLLOW_FIELDS = ("id", "username", "followed_at")
+
+
+class FriendShipApiView(JsonApiView):
+    """フォロー・フォロワーの一覧を新しい順に {"users": [{"id", "username", "followed_at"}], "next": カーソル} で返す。"""
+
+    allowed_fields = FOLLOW_FIELDS
+    paginate_by = 50
+    # FriendShipListView と同じく，対象のユーザーの側（user_field）と表示する相手の側（other_field）
+    user_field = None
+    other_field = None
+
+    def get_data(self):
+        user_id = CustomUser.objects.filter(username=self.kwargs["username"]).values_list("pk", flat=True).first()
+        if user_id is None:
+            raise Http404("No user matches the given query.")
+        columns = {"user_id": F(f"{self.other_field}_id")}
+        if "username" in self.fields:
+            columns["username"] = F(f"{self.other_field}__username")
+        friendships = FriendShip.objects.filter(**{f"{self.user_field}_id": user_id})
+        friendships = friendships.values("id", "created_at", **columns)
+        page = CursorPaginator(friendships, self.paginate_by).page(self.request.GET.get("before"))
+        values = {"id": "user_id", "username": "username", "followed_at": "created_at"}
+        users = [{field: friendship[values[field]] for field in self.fields} for friendship in page]
+        return {"users": users, "next": page.next_cursor}
+
+
+class FollowingApiView(FriendShipApiView):
+    user_field = "follower"
+    other_field = "followee"
+
+
+class FollowerApiView(FriendShipApiView):
+    user_field = "followee"
+    other_field = "follower"
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from mysite import caching
+
+
+def cached_user_key(user_id):
+    return caching.user_key(user_id, "auth")
+
+
+class CachedModelBackend(ModelBackend):
+    """request.user の読み込みをキャッシュ経由にする認証バックエンド。
+
+    キャッシュは CustomUser の保存・削除時とフォロー数の更新時に accounts.signals で削除する。
+    """
+
+    def get_user(self, user_id):
+        key = cached_user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+        return user
@@ -0,0 +1,106 @@
+"""ユーザーのツイート・いいね・フォロー関係を NDJSON か CSV で書き出す。
+
+行はインデックスの順に queryset.iterator() で少しずつ読み込むため，行数が多くてもメモリの使用量は一定になる。
+書き出した行の id を after に渡すと，その行の次から再開できる（再開時は CSV のヘッダーを省く）。
+"""
+
+import csv
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from tweets.models import Like, Tweet
+from tweets.pagination import after_cursor
+
+from .models import FriendShip
+
+FORMATS = ("ndjson", "csv")
+CHUNK_SIZE = 2000
+
+# 種類: (モデル, 対象のユーザーの側, 並び順のキー, {列名: 参照するフィールド})
+# 並び順のキーは，対象のユーザーの側から始まるインデックスの順にする
+EXPORTS = {
+    "tweets": (
+        Tweet,
+        "user",
+        ("created_at", "id"),
+        {"id": "id", "created_at": "created_at", "content": "content", "like_count": "like_count"},
+    ),
+    "likes": (Like, "user", ("tweet_id",), {"id": "id", "tweet_id": "tweet_id"}),
+    "following": (
+        FriendShip,
+        "follower",
+        ("created_at", "id"),
+        {"id": "id", "user_id": "followee_id", "username": "followee__username", "created_at": "created_at"},
+    ),
+    "followers": (
+        FriendShip,
+        "followee",
+        ("created_at", "id"),
+        {"id": "id", "user_id": "follower_id", "username": "follower__username", "created_at": "created_at"},
+    ),
+}
+
+
+class InvalidExport(Exception):
+    pass
+
+
+class _Echo:
+    # csv.writer の書き込み先。書き込んだ行をそのまま返す
+    def write(self, value):
+        return value
+
+
+def _format_csv_value(value):
+    # 日時は NDJSON と同じ形式にする
+    return DjangoJSONEncoder().default(value) if isinstance(value, datetime) else value
+
+
+def export_queryset(user, kind, after=None):
+    """(列名, 行のタプルのクエリセット) を返す。after は前回書き出した最後の行の id。"""
+    if kind not in EXPORTS:
+        raise InvalidExport(f"unknown kind: {kind}")
+    model, user_field, keys, columns = EXPORTS[kind]
+    queryset = model.objects.filter(**{user_field: user})
+    if after is not None:
+        # 行の id から並び順のキーを引き，その行より後の行だけを残す
+        key = queryset.filter(pk=after).values_list(*keys).first()
+        if key is None:
+            raise InvalidExport(f"unknown cursor: {after}")
+        queryset = queryset.filter(after_cursor(*key) if len(keys) == 2 else Q(**{f"{keys[0]}__gt": key[0]}))
+    return list(columns), queryset.order_by(*keys).values_list(*columns.values())
+
+
+def export(user, kind, format, after=None):
+    """書き出す内容を CHUNK_SIZE 行ずつの文字列で返すイテレーター。"""
+    if format not in FORMATS:
+        raise InvalidExport(f"unknown format: {format}")
+    header, queryset = export_queryset(user, kind, after)
+    rows = queryset.iterator(chunk_size=CHUNK_SIZE)
+    return _export_ndjson(header, rows) if format == "ndjson" else _export_csv(header, rows, after is None)
+
+
+def _chunks(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def _export_ndjson(header, rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    return _chunks(encoder.encode(dict(zip(header, row))) + "\n" for row in rows)
+
+
+def _export_csv(header, rows, with_header):
+    writer = csv.writer(_Echo())
+    lines = (writer.writerow([_format_csv_value(value) for value in row]) for row in rows)
+    if with_header:
+        yield writer.writerow(header)
+    yield from _chunks(lines)
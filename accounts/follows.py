@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, When
+from django.db.models.functions import Coalesce
+
+from .models import FriendShip
+
+CustomUser = get_user_model()
+
+
+@transaction.atomic
+def follow(follower, followee):
+    """フォローを登録してフォロー数・フォロワー数を更新する。新たにフォローした場合は True を返す。"""
+    _, created = FriendShip.objects.get_or_create(follower=follower, followee=followee)
+    if created:
+        CustomUser.objects.filter(pk=follower.pk).update(following_count=F("following_count") + 1)
+        # 閾値に達したらファンアウトをやめる。戻すのは update_celebrities で行う
+        CustomUser.objects.filter(pk=followee.pk).update(
+            follower_count=F("follower_count") + 1,
+            is_celebrity=Case(
+                When(follower_count__gte=settings.TIMELINE_FAN_OUT_THRESHOLD - 1, then=True),
+                default=F("is_celebrity"),
+            ),
+        )
+    return created
+
+
+@transaction.atomic
+def unfollow(follower, followee):
+    """フォローを解除してフォロー数・フォロワー数を更新する。解除した場合は True を返す。"""
+    deleted, _ = FriendShip.objects.filter(follower=follower, followee=followee).delete()
+    if deleted:
+        CustomUser.objects.filter(pk=follower.pk).update(following_count=F("following_count") - 1)
+        CustomUser.objects.filter(pk=followee.pk).update(follower_count=F("follower_count") - 1)
+    return bool(deleted)
+
+
+def _actual_count(field):
+    friendships = FriendShip.objects.filter(**{field: OuterRef("pk")}).values(field)
+    return Coalesce(Subquery(friendships.annotate(count=Count("pk")).values("count")), 0)
+
+
+def repair_follow_counts(queryset=None):
+    """フォロー数・フォロワー数を FriendShip の実際の件数に合わせ，修正したユーザー数を返す。"""
+    queryset = CustomUser.objects.all() if queryset is None else queryset
+    with transaction.atomic():
+        drifted = list(
+            queryset.annotate(
+                actual_follower_count=_actual_count("followee"),
+                actual_following_count=_actual_count("follower"),
+            )
+            .exclude(follower_count=F("actual_follower_count"), following_count=F("actual_following_count"))
+            .values_list("pk", flat=True)
+        )
+        CustomUser.objects.filter(pk__in=drifted).update(
+            follower_count=_actual_count("followee"),
+            following_count=_actual_count("follower"),
+        )
+    return len(drifted)
@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import export
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "ユーザーのツイート・いいね・フォロー・フォロワーを NDJSON か CSV で標準出力に書き出します。"
+        "--after に書き出した最後の行の id を指定すると，その続きから書き出します。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("kind", choices=list(export.EXPORTS))
+        parser.add_argument("--format", choices=export.FORMATS, default="ndjson")
+        parser.add_argument("--after", type=int, help="前回書き出した最後の行の id")
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(username=options["username"])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"ユーザー {options['username']} は存在しません。")
+        try:
+            chunks = export.export(user, options["kind"], options["format"], options["after"])
+        except export.InvalidExport:
+            raise CommandError(f"id が {options['after']} の行が見つかりません。")
+        for chunk in chunks:
+            self.stdout.write(chunk, ending="")
@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts.follows import repair_follow_counts
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "CustomUser のフォロー数・フォロワー数を FriendShip の実際の件数に合わせて修正します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000, help="1 トランザクションで確認するユーザー数")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        fixed = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                CustomUser.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            fixed += repair_follow_counts(CustomUser.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]))
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS(f"{fixed} 人のフォロー数・フォロワー数を修正しました。"))
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.13 on 2026-10-18 09:22
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_follow_counts(apps, schema_editor):
+    CustomUser = apps.get_model("accounts", "CustomUser")
+    FriendShip = apps.get_model("accounts", "FriendShip")
+
+    def count_by(field):
+        friendships = FriendShip.objects.filter(**{field: OuterRef("pk")}).values(field)
+        return Coalesce(Subquery(friendships.annotate(count=Count("pk")).values("count")), 0)
+
+    CustomUser.objects.update(follower_count=count_by("followee"), following_count=count_by("follower"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="follower_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="フォロワー数"),
+        ),
+        migrations.AddField(
+            model_name="customuser",
+            name="following_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="フォロー数"),
+        ),
+        migrations.RunPython(populate_follow_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_is_celebrity(apps, schema_editor):
+    # これまではフォロワー数が閾値以上のユーザーを有名ユーザーとして扱っていた
+    CustomUser = apps.get_model("accounts", "CustomUser")
+    CustomUser.objects.filter(follower_count__gte=settings.TIMELINE_FAN_OUT_THRESHOLD).update(is_celebrity=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0004_friendship_index_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="is_celebrity",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(populate_is_celebrity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import LoginRequiredMixin
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """ハンドラが async のビュー用の LoginRequiredMixin。
+
+    request.user の読み込みはセッションやデータベースへの同期的なアクセスを伴うため，
+    イベントループの外で読み込んでからログインを確認する。
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return self.handle_no_permission()
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
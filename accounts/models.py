@@ -12,18 +12,26 @@ class CustomUser(AbstractUser):
         through="FriendShip",
         symmetrical=False,
     )
+    # FriendShip の件数の非正規化．更新は accounts.follows 経由で F() により行う
+    follower_count = models.PositiveIntegerField(verbose_name="フォロワー数", default=0)
+    following_count = models.PositiveIntegerField(verbose_name="フォロー数", default=0)
+    # True の間はツイートをファンアウトせず，読み込み時にマージする（tweets.timeline）
+    is_celebrity = models.BooleanField(default=False)
 
 
 class FriendShip(models.Model):
+    # follower / followee の検索は Meta の複合インデックスで行うため，外部キー単独のインデックスは作らない
     follower = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         related_name="follower",
         on_delete=models.CASCADE,
+        db_index=False,
     )
     followee = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         related_name="followee",
         on_delete=models.CASCADE,
+        db_index=False,
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -34,3 +42,7 @@ class FriendShip(models.Model):
                 name="unique_friendship",
             )
         ]
+        indexes = [
+            models.Index(fields=["follower", "-created_at", "-id"], name="friendship_follower_idx"),
+            models.Index(fields=["followee", "-created_at", "-id"], name="friendship_followee_idx"),
+        ]
@@ -0,0 +1,30 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mysite import caching
+
+from .backends import cached_user_key
+from .models import FriendShip
+
+CustomUser = get_user_model()
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    cache.delete(cached_user_key(instance.pk))
+    caching.bump_version(caching.USER, instance.pk)
+
+
+@receiver(post_save, sender=FriendShip)
+@receiver(post_delete, sender=FriendShip)
+def bump_friendship_versions(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    caching.bump_versions(caching.USER, [instance.follower_id, instance.followee_id])
+    # フォロー数・フォロワー数は F() で更新され post_save が送られないため，コミット後にここで削除する
+    keys = [cached_user_key(instance.follower_id), cached_user_key(instance.followee_id)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
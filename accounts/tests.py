@@ -1,10 +1,21 @@
-from django.contrib.auth import SESSION_KEY, get_user_model
-from django.test import TestCase
+import json
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import BACKEND_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test import AsyncClient, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from mysite import settings
-from tweets.models import Tweet
+from tweets.models import Like, Tweet
 
+from . import follows
+from .backends import CachedModelBackend
 from .models import FriendShip
 
 CustomUser = get_user_model()
@@ -166,6 +177,51 @@ class TestSignUpView(TestCase):
         self.assertFormError(response, "form", "password2", "確認用パスワードが一致しません。")
 
 
+class TestCachedModelBackend(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username="testuser", email="test@example.com", password="Hp9My5mi")
+        self.other = CustomUser.objects.create_user(username="testuser02", password="v6EaZYBT")
+        self.backend = CachedModelBackend()
+
+    def test_get_user_from_cache(self):
+        self.assertEqual(self.backend.get_user(self.user.pk), self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.get_user(self.user.pk), self.user)
+
+    def test_invalidated_on_save(self):
+        self.backend.get_user(self.user.pk)
+        self.user.email = "changed@example.com"
+        self.user.save()
+        self.assertEqual(self.backend.get_user(self.user.pk).email, "changed@example.com")
+
+    def test_invalidated_on_follow(self):
+        self.backend.get_user(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            follows.follow(self.user, self.other)
+        self.assertEqual(self.backend.get_user(self.user.pk).following_count, 1)
+
+    def test_no_session_or_user_query_per_request(self):
+        self.client.login(username="testuser", password="Hp9My5mi")
+        self.client.get(reverse("tweets:home"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(response.context["user"], self.user)
+        sqls = [query["sql"] for query in queries]
+        self.assertFalse([sql for sql in sqls if 'FROM "django_session"' in sql])
+        self.assertFalse([sql for sql in sqls if 'WHERE "accounts_customuser"."id" =' in sql])
+
+    def test_existing_model_backend_session(self):
+        # CachedModelBackend にする前のセッションもログインしたままになる
+        self.client.force_login(self.user, backend="django.contrib.auth.backends.ModelBackend")
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["user"], self.user)
+        self.client.logout()
+        self.client.login(username="testuser", password="Hp9My5mi")
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY], "accounts.backends.CachedModelBackend")
+
+
 class TestLoginView(TestCase):
     def setUp(self):
         self.user = CustomUser.objects.create_user(username="testuser", email="test@example.com", password="Hp9My5mi")
@@ -249,6 +305,36 @@ class TestUserProfileView(TestCase):
             self.user1.follow_by.count(),
         )
 
+    def test_success_get_with_follow_counts(self):
+        follows.follow(self.user3, self.user1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("accounts:profile", kwargs={"username": "testuser01"}))
+        self.assertFalse([query for query in queries if "COUNT(" in query["sql"]])
+        self.assertEqual(response.context["following_count"], 0)
+        self.assertEqual(response.context["follower_count"], 1)
+
+    def test_stream(self):
+        tweets = [Tweet.objects.create(user=self.user2, content=f"tweet{i}") for i in range(3)]
+        Like.objects.create(tweet=tweets[1], user=self.user1)
+        url = reverse("accounts:profile", kwargs={"username": "testuser02"})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {"stream": "1"})
+            before_stream = len(queries)
+            chunks = [chunk.decode() for chunk in response.streaming_content]
+        # ツイートは送り始めてから読み込む
+        self.assertGreater(len(queries), before_stream)
+        self.assertIn("testuser02のプロフィール", chunks[0])
+        self.assertTrue(chunks[-1].rstrip().endswith("</html>"))
+        content = "".join(chunks)
+        self.assertLess(content.index("tweet2"), content.index("tweet1"))
+        self.assertLess(content.index("tweet1"), content.index("tweet0"))
+        self.assertIn(reverse("tweets:unlike", kwargs={"pk": tweets[1].pk}), content)
+        self.assertEqual(content.count('class="count_'), 3)
+
+    def test_stream_not_exists_user(self):
+        response = self.client.get(reverse("accounts:profile", kwargs={"username": "notexists"}), {"stream": "1"})
+        self.assertEqual(response.status_code, 404)
+
 
 class TestUserProfileEditView(TestCase):
     def test_success_get(self):
@@ -283,6 +369,10 @@ class TestFollowView(TestCase):
             target_status_code=200,
         )
         self.assertEqual(self.user1.following.count(), 1)
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.following_count, 1)
+        self.assertEqual(self.user2.follower_count, 1)
 
     def test_failure_post_with_not_exist_user(self):
         response = self.client.post(reverse("accounts:follow", kwargs={"username": "null"}))
@@ -294,6 +384,15 @@ class TestFollowView(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(self.user1.following.count(), 0)
 
+    async def test_success_post_via_asgi(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user1)
+        response = await client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        self.assertRedirects(response, reverse("tweets:home"), fetch_redirect_response=False)
+        self.assertTrue(await FriendShip.objects.filter(follower=self.user1, followee=self.user2).aexists())
+        follower_count = await CustomUser.objects.values_list("follower_count", flat=True).aget(pk=self.user2.pk)
+        self.assertEqual(follower_count, 1)
+
 
 class TestUnfollowView(TestCase):
     def setUp(self):
@@ -304,12 +403,16 @@ class TestUnfollowView(TestCase):
             username="testuser01",
             password="a4AXBLnb",
         )
-        self.user1.following.add(self.user2)
+        follows.follow(self.user1, self.user2)
 
     def test_success_post(self):
         response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "testuser02"}))
         self.assertRedirects(response, reverse("tweets:home"), status_code=302, target_status_code=200)
         self.assertEqual(self.user1.following.count(), 0)
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.following_count, 0)
+        self.assertEqual(self.user2.follower_count, 0)
 
     def test_failure_post_with_not_exist_user(self):
         response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "null"}))
@@ -322,6 +425,22 @@ class TestUnfollowView(TestCase):
         self.assertEqual(self.user1.following.count(), 1)
 
 
+class TestRepairFollowCountsCommand(TestCase):
+    def test_success(self):
+        user1 = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        user2 = CustomUser.objects.create_user(username="testuser02", password="v6EaZYBT")
+        user1.following.add(user2)
+        CustomUser.objects.filter(pk=user2.pk).update(following_count=3)
+
+        out = StringIO()
+        call_command("repair_follow_counts", batch_size=1, stdout=out)
+        self.assertIn("2 人", out.getvalue())
+        user1.refresh_from_db()
+        user2.refresh_from_db()
+        self.assertEqual((user1.following_count, user1.follower_count), (1, 0))
+        self.assertEqual((user2.following_count, user2.follower_count), (0, 1))
+
+
 class TestFollowingListView(TestCase):
     def setUp(self):
         self.user1 = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
@@ -334,6 +453,49 @@ class TestFollowingListView(TestCase):
         response = self.client.get(reverse("accounts:following_list", kwargs={"username": "testuser01"}))
         self.assertEqual(response.status_code, 200)
 
+    def create_followees(self, count):
+        users = CustomUser.objects.bulk_create(CustomUser(username=f"followee{i:02}") for i in range(count))
+        FriendShip.objects.bulk_create(FriendShip(follower=self.user1, followee=user) for user in users)
+        return list(reversed(users))
+
+    def test_pagination(self):
+        followees = self.create_followees(51)
+        url = reverse("accounts:following_list", kwargs={"username": "testuser01"})
+        self.client.get(url)  # セッションとユーザーをキャッシュに載せる
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get(url)
+        self.assertEqual(response.context["username"], "testuser01")
+        page = response.context["page_obj"]
+        self.assertEqual([friendship.followee for friendship in page], followees[:50])
+        self.assertContains(response, f"?before={page.next_cursor}")
+        with CaptureQueriesContext(connection) as second_page:
+            response = self.client.get(url, {"before": page.next_cursor})
+        self.assertEqual([friendship.followee for friendship in response.context["page_obj"]], followees[50:])
+        self.assertFalse(response.context["page_obj"].has_next())
+        # 相手のユーザーは select_related で取得するので，件数によってクエリ数が変わらない
+        self.assertEqual(len(first_page), len(second_page))
+
+    def test_json(self):
+        # JSON は API の一覧に転送し，カーソルも引き継ぐ
+        followees = self.create_followees(2)
+        url = reverse("accounts:following_list", kwargs={"username": "testuser01"})
+        api_url = reverse("accounts:api_following", kwargs={"username": "testuser01"})
+        response = self.client.get(url, {"format": "json"})
+        self.assertRedirects(response, api_url, status_code=301)
+        data = self.client.get(api_url).json()
+        self.assertEqual([user["username"] for user in data["users"]], [user.username for user in followees])
+        self.assertIsNone(data["next"])
+        response = self.client.get(url, {"format": "json", "before": "cursor"})
+        self.assertRedirects(response, f"{api_url}?before=cursor", status_code=301, fetch_redirect_response=False)
+
+    def test_invalid_cursor(self):
+        url = reverse("accounts:following_list", kwargs={"username": "testuser01"})
+        self.assertEqual(self.client.get(url, {"before": "invalid"}).status_code, 404)
+
+    def test_failure_get_with_not_exists_user(self):
+        response = self.client.get(reverse("accounts:following_list", kwargs={"username": "notexists"}))
+        self.assertEqual(response.status_code, 404)
+
 
 class TestFollowerListView(TestCase):
     def setUp(self):
@@ -346,3 +508,144 @@ class TestFollowerListView(TestCase):
     def test_success_get(self):
         response = self.client.get(reverse("accounts:follower_list", kwargs={"username": "testuser01"}))
         self.assertEqual(response.status_code, 200)
+
+    def test_lists_followers(self):
+        users = CustomUser.objects.bulk_create(CustomUser(username=f"follower{i}") for i in range(2))
+        FriendShip.objects.bulk_create(FriendShip(follower=user, followee=self.user1) for user in users)
+        response = self.client.get(reverse("accounts:follower_list", kwargs={"username": "testuser01"}))
+        self.assertEqual([friendship.follower for friendship in response.context["follower_list"]], users[::-1])
+        self.assertContains(response, "follower0")
+
+    def test_stream(self):
+        users = CustomUser.objects.bulk_create(CustomUser(username=f"follower{i}") for i in range(60))
+        FriendShip.objects.bulk_create(FriendShip(follower=user, followee=self.user1) for user in users)
+        url = reverse("accounts:follower_list", kwargs={"username": "testuser01"})
+        response = self.client.get(url, {"stream": "1"})
+        content = b"".join(response.streaming_content).decode()
+        # ページングせずに全員を新しい順に返す
+        self.assertEqual(content.count("/accounts/follower"), 60)
+        self.assertLess(content.index(">follower59<"), content.index(">follower0<"))
+        self.assertNotIn("次へ", content)
+
+
+class TestFriendShipApiView(TestCase):
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        self.user2 = CustomUser.objects.create_user(username="testuser02", password="v6EaZYBT")
+        self.friendship = FriendShip.objects.create(follower=self.user1, followee=self.user2)
+        self.client.force_login(self.user1)
+
+    def test_following(self):
+        response = self.client.get(reverse("accounts:api_following", kwargs={"username": "testuser01"}))
+        self.assertEqual(
+            response.json(),
+            {
+                "users": [
+                    {
+                        "id": self.user2.pk,
+                        "username": "testuser02",
+                        "followed_at": DjangoJSONEncoder().default(self.friendship.created_at),
+                    }
+                ],
+                "next": None,
+            },
+        )
+
+    def test_followers_with_fields(self):
+        url = reverse("accounts:api_followers", kwargs={"username": "testuser02"})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {"fields": "username"})
+        self.assertEqual(response.json(), {"users": [{"username": "testuser01"}], "next": None})
+        # セッション・ログインユーザー・対象のユーザー・フォロワーの一覧
+        self.assertLessEqual(len(queries), 4)
+        self.assertEqual(self.client.get(url, {"fields": "password"}).status_code, 400)
+
+    def test_not_exists_user(self):
+        response = self.client.get(reverse("accounts:api_following", kwargs={"username": "notexists"}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestExport(TestCase):
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        self.user2 = CustomUser.objects.create_user(username="testuser02", password="v6EaZYBT")
+        self.tweets = [Tweet.objects.create(user=self.user1, content=f"ツイート{i}") for i in range(3)]
+        self.other_tweet = Tweet.objects.create(user=self.user2, content="other")
+        Like.objects.create(tweet=self.other_tweet, user=self.user1)
+        follows.follow(self.user1, self.user2)
+        self.client.force_login(self.user1)
+
+    def get(self, kind, **params):
+        response = self.client.get(reverse("accounts:export", kwargs={"kind": kind}), params)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        response, content = self.get("tweets")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertIn('filename="testuser01-tweets.ndjson"', response["Content-Disposition"])
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row["content"] for row in rows], ["ツイート0", "ツイート1", "ツイート2"])
+        self.assertEqual(set(rows[0]), {"id", "created_at", "content", "like_count"})
+
+    def test_resume(self):
+        _, content = self.get("tweets", after=self.tweets[0].pk)
+        self.assertEqual([json.loads(line)["id"] for line in content.splitlines()], [t.pk for t in self.tweets[1:]])
+        _, content = self.get("tweets", after=self.tweets[-1].pk)
+        self.assertEqual(content, "")
+
+    def test_csv(self):
+        _, content = self.get("following", format="csv")
+        lines = content.splitlines()
+        self.assertEqual(lines[0], "id,user_id,username,created_at")
+        self.assertEqual(len(lines), 2)
+        self.assertIn(f",{self.user2.pk},testuser02,", lines[1])
+        friendship = FriendShip.objects.get(follower=self.user1)
+        # 再開時はヘッダーを省く
+        _, content = self.get("following", format="csv", after=friendship.pk)
+        self.assertEqual(content, "")
+
+    def test_likes_and_followers(self):
+        _, content = self.get("likes")
+        self.assertEqual([json.loads(line)["tweet_id"] for line in content.splitlines()], [self.other_tweet.pk])
+        _, content = self.get("followers")
+        self.assertEqual(content, "")
+
+    def test_invalid(self):
+        url = reverse("accounts:export", kwargs={"kind": "passwords"})
+        self.assertEqual(self.client.get(url).status_code, 400)
+        url = reverse("accounts:export", kwargs={"kind": "tweets"})
+        self.assertEqual(self.client.get(url, {"format": "xml"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"after": "abc"}).status_code, 400)
+        # 他のユーザーの行はカーソルに使えない
+        self.assertEqual(self.client.get(url, {"after": self.other_tweet.pk}).status_code, 400)
+
+    def test_requires_login(self):
+        self.client.logout()
+        response = self.client.get(reverse("accounts:export", kwargs={"kind": "tweets"}))
+        self.assertEqual(response.status_code, 302)
+
+    def test_user_named_export(self):
+        # 書き出しの URL はユーザーのページと重ならない
+        CustomUser.objects.create_user(username="export", password="b7KqWmxP")
+        friendships = FriendShip.objects.filter(follower=self.user1, followee__username="export")
+        response = self.client.post(reverse("accounts:follow", kwargs={"username": "export"}))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(friendships.exists())
+        for name in ("following_list", "follower_list"):
+            response = self.client.get(reverse(f"accounts:{name}", kwargs={"username": "export"}))
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "export"}))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(friendships.exists())
+
+    def test_command(self):
+        out = StringIO()
+        call_command("export_user_data", "testuser01", "tweets", "--format", "csv", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "id,created_at,content,like_count")
+        self.assertEqual(len(lines), 4)
+        out = StringIO()
+        call_command("export_user_data", "testuser01", "tweets", "--after", str(self.tweets[1].pk), stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["id"], self.tweets[2].pk)
+        with self.assertRaises(CommandError):
+            call_command("export_user_data", "notexists", "tweets", stdout=out)
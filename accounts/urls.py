@@ -1,13 +1,17 @@
 from django.contrib.auth import views as auth_views
 from django.urls import path
 
-from . import views
+from . import api, views
 
 app_name = "accounts"
 urlpatterns = [
     path("signup/", views.SignUpView.as_view(), name="signup"),
     path("login/", views.LoginView.as_view(), name="login"),
     path("logout/", auth_views.LogoutView.as_view(), name="logout"),
+    path("api/<str:username>/following/", api.FollowingApiView.as_view(), name="api_following"),
+    path("api/<str:username>/followers/", api.FollowerApiView.as_view(), name="api_followers"),
+    # ユーザー名に使えない文字から始め，"<str:username>/..." と重ならないようにする
+    path("~export/<str:kind>/", views.ExportView.as_view(), name="export"),
     path("<str:username>/", views.UserProfileView.as_view(), name="profile"),
     path("<str:username>/follow/", views.FollowView.as_view(), name="follow"),
     path("<str:username>/unfollow/", views.UnFollowView.as_view(), name="unfollow"),
@@ -1,15 +1,26 @@
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth import authenticate, get_user_model, login
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView, LogoutView
-from django.http import HttpResponseBadRequest
+from django.db import transaction
+from django.http import Http404, HttpResponseBadRequest, HttpResponsePermanentRedirect, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
-from django.urls import reverse_lazy
-from django.views.generic import CreateView, ListView, RedirectView, TemplateView
-
-from tweets.models import Like, Tweet
-
+from django.urls import reverse, reverse_lazy
+from django.views import View
+from django.views.generic import CreateView, ListView
+
+from mysite import caching
+from mysite.conditional import ConditionalGetMixin
+from mysite.routers import ReplicaReadMixin
+from mysite.streaming import StreamingListMixin, SyncIteratorResponse
+from tweets import likes, timeline
+from tweets.models import Tweet
+from tweets.pagination import CursorPaginationMixin
+
+from . import export, follows
 from .forms import LoginForm, SignupForm
+from .mixins import AsyncLoginRequiredMixin
 from .models import FriendShip
 
 CustomUser = get_user_model()
@@ -43,15 +54,24 @@ class LogoutView(LogoutView):
     pass
 
 
-class UserProfileView(LoginRequiredMixin, ListView):
+class UserProfileView(LoginRequiredMixin, ReplicaReadMixin, ConditionalGetMixin, StreamingListMixin, ListView):
     template_name = "accounts/profile.html"
+    rows_template_name = "tweets/tweet_list.html"
     model = Tweet
     context_object_name = "tweets_list"
 
+    def get_etag_parts(self):
+        user_id = CustomUser.objects.filter(username=self.kwargs["username"]).values_list("pk", flat=True).first()
+        if user_id is None:
+            return None
+        # ユーザーのバージョンはフォローとユーザー名の変更，閲覧者のいいねで，
+        # 投稿者のバージョンはツイートの投稿・削除とそれらへのいいねで進む。ツイートの件数によらず一定の手間で済む
+        user_versions = caching.get_versions(caching.USER, {user_id, self.request.user.pk})
+        return [sorted(user_versions.items()), caching.get_version(caching.AUTHOR, user_id)]
+
     def get_queryset(self):
         return (
             Tweet.objects.select_related("user")
-            .prefetch_related("liked_tweet")
             .filter(user__username=self.kwargs.get("username"))
             .order_by("-created_at")
         )
@@ -61,67 +81,138 @@ class UserProfileView(LoginRequiredMixin, ListView):
         context = super().get_context_data(**kwargs)
         context["username"] = user.username
         context["is_following"] = self.request.user.following.filter(username=user.username).exists()
-        context["following_count"] = FriendShip.objects.filter(follower=user).count()
-        context["follower_count"] = FriendShip.objects.filter(followee=user).count()
-        context["liked_list"] = (
-            Like.objects.select_related("tweet").filter(user=self.request.user).values_list("tweet", flat=True)
-        )
+        context["following_count"] = user.following_count
+        context["follower_count"] = user.follower_count
+        context["liked_tweet_ids"] = likes.liked_tweet_ids(self.request.user, context["tweets_list"])
+        likes.merge_pending_like_counts(context["tweets_list"])
         return context
 
+    def get_rows_context_data(self, rows):
+        likes.merge_pending_like_counts(rows)
+        return {"tweet_list": rows, "liked_tweet_ids": likes.liked_tweet_ids(self.request.user, rows)}
+
+
+# 非同期のトランザクションはないため，フォローとタイムラインの更新はまとめてスレッドで実行する
+@sync_to_async
+@transaction.atomic
+def follow_and_backfill(user, target_user):
+    follows.follow(user, target_user)
+    timeline.backfill(user, target_user)
+
 
-class FollowView(LoginRequiredMixin, RedirectView):
+@sync_to_async
+@transaction.atomic
+def unfollow_and_prune(user, target_user):
+    if follows.unfollow(user, target_user):
+        timeline.prune(user, target_user)
+
+
+async def aget_user_or_404(username):
+    try:
+        return await CustomUser.objects.aget(username=username)
+    except CustomUser.DoesNotExist:
+        raise Http404("No user matches the given query.")
+
+
+class FollowView(AsyncLoginRequiredMixin, View):
     url = reverse_lazy("tweets:home")
 
-    def post(self, request, *args, **kwargs):
-        target_user = get_object_or_404(CustomUser, username=self.kwargs["username"])
+    async def post(self, request, *args, **kwargs):
+        target_user = await aget_user_or_404(self.kwargs["username"])
         if target_user == self.request.user:
             messages.add_message(request, messages.ERROR, "自分自身をフォローすることはできません。")
             return HttpResponseBadRequest("you cannnot follow yourself.")
-        elif self.request.user.following.filter(username=target_user.username).exists():
+        elif await self.request.user.following.filter(pk=target_user.pk).aexists():
             messages.add_message(request, messages.INFO, "既にフォローしています。")
         else:
-            self.request.user.following.add(target_user)
+            await follow_and_backfill(self.request.user, target_user)
             messages.add_message(request, messages.SUCCESS, "フォローしました。")
-        return super().post(request, *args, **kwargs)
+        return HttpResponseRedirect(self.url)
 
 
-class UnFollowView(LoginRequiredMixin, RedirectView):
+class UnFollowView(AsyncLoginRequiredMixin, View):
     url = reverse_lazy("tweets:home")
 
-    def post(self, request, *args, **kwargs):
-        target_user = get_object_or_404(CustomUser, username=self.kwargs["username"])
+    async def post(self, request, *args, **kwargs):
+        target_user = await aget_user_or_404(self.kwargs["username"])
         if target_user == self.request.user:
             messages.add_message(request, messages.ERROR, "自分自身をフォロー解除することはできません。")
             return HttpResponseBadRequest("you cannot unfollow yourself.")
-        elif self.request.user.following.filter(username=target_user.username).exists():
-            self.request.user.following.remove(target_user)
+        elif await self.request.user.following.filter(pk=target_user.pk).aexists():
+            await unfollow_and_prune(self.request.user, target_user)
             messages.add_message(request, messages.SUCCESS, "フォロー解除しました。")
         else:
             messages.add_message(request, messages.INFO, "このユーザーをフォローしていません。")
-        return super().post(request, *args, **kwargs)
+        return HttpResponseRedirect(self.url)
 
 
-class FollowingListView(LoginRequiredMixin, TemplateView):
-    template_name = "accounts/following_list.html"
+class FriendShipListView(LoginRequiredMixin, ReplicaReadMixin, StreamingListMixin, CursorPaginationMixin, ListView):
+    """FriendShip を新しい順にカーソルでページングし，相手のユーザーを表示する。
 
-    def get_context_data(self, **kwargs):
-        target_user = get_object_or_404(
-            CustomUser,
-            username=self.kwargs.get("username"),
-        )
-        context = super().get_context_data(**kwargs)
-        context["following_list"] = target_user.follower.order_by("-created_at")
-        return context
+    ?stream=1 のときは全件をストリーミングする。JSON は accounts.api の api_url_name で返し，
+    以前の ?format=json はそちらに転送する。
+    """
 
+    paginate_by = 50
+    # 対象のユーザーが FriendShip のどちら側か（user_field）と，表示する相手側（other_field）
+    user_field = None
+    other_field = None
+    api_url_name = None
 
-class FollowerListView(LoginRequiredMixin, TemplateView):
-    template_name = "accounts/follower_list.html"
+    def get(self, request, *args, **kwargs):
+        if request.GET.get("format") == "json":
+            query = request.GET.copy()
+            del query["format"]
+            url = reverse(self.api_url_name, kwargs={"username": self.kwargs["username"]})
+            return HttpResponsePermanentRedirect(f"{url}?{query.urlencode()}" if query else url)
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        self.target_user = get_object_or_404(CustomUser, username=self.kwargs.get("username"))
+        return FriendShip.objects.select_related(self.other_field).filter(**{self.user_field: self.target_user})
+
+    def get_stream_queryset(self):
+        return self.get_queryset().order_by("-created_at", "-id")
 
     def get_context_data(self, **kwargs):
-        target_user = get_object_or_404(
-            CustomUser,
-            username=self.kwargs.get("username"),
-        )
         context = super().get_context_data(**kwargs)
-        context["follower_list"] = target_user.followee.order_by("-created_at")
+        context["username"] = self.target_user.username
         return context
+
+
+class FollowingListView(FriendShipListView):
+    template_name = "accounts/following_list.html"
+    rows_template_name = "accounts/following_rows.html"
+    context_object_name = "following_list"
+    user_field = "follower"
+    other_field = "followee"
+    api_url_name = "accounts:api_following"
+
+
+class FollowerListView(FriendShipListView):
+    template_name = "accounts/follower_list.html"
+    rows_template_name = "accounts/follower_rows.html"
+    context_object_name = "follower_list"
+    user_field = "followee"
+    other_field = "follower"
+    api_url_name = "accounts:api_followers"
+
+
+class ExportView(LoginRequiredMixin, View):
+    """ログイン中のユーザーのデータを ?format=ndjson|csv でダウンロードさせる。?after= で途中から再開できる。"""
+
+    content_types = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+    def get(self, request, *args, **kwargs):
+        kind = self.kwargs["kind"]
+        format = request.GET.get("format", "ndjson")
+        after = request.GET.get("after")
+        if after is not None and not after.isdigit():
+            return HttpResponseBadRequest("invalid cursor.")
+        try:
+            chunks = export.export(request.user, kind, format, int(after) if after else None)
+        except export.InvalidExport as e:
+            return HttpResponseBadRequest(str(e))
+        response = SyncIteratorResponse(chunks, content_type=self.content_types[format])
+        response["Content-Disposition"] = f'attachment; filename="{request.user.username}-{kind}.{format}"'
+        return response
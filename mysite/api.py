@@ -0,0 +1,51 @@
+"""読み込み専用の JSON API のビューの基底クラス。
+
+?fields=id,content のように返すフィールドを選べ，レスポンスは空白を除いた JSON にする。
+"""
+
+from abc import ABC, abstractmethod
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404, JsonResponse
+from django.views import View
+
+from mysite.routers import ReplicaReadMixin
+from tweets.pagination import InvalidCursor
+
+
+class InvalidFields(Exception):
+    pass
+
+
+def parse_fields(value, allowed):
+    if not value:
+        return allowed
+    fields = tuple(dict.fromkeys(value.split(",")))
+    if not set(fields) <= set(allowed):
+        raise InvalidFields(value)
+    return fields
+
+
+class JsonApiView(LoginRequiredMixin, ReplicaReadMixin, ABC, View):
+    """fields を検証して get_data() の結果を JSON で返す。未ログインの場合は 403 を返す。
+
+    サブクラスは allowed_fields と get_data() を定義する。
+    """
+
+    raise_exception = True
+    allowed_fields = ()
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.fields = parse_fields(request.GET.get("fields"), self.allowed_fields)
+        except InvalidFields:
+            return JsonResponse({"error": "invalid fields."}, status=400)
+        try:
+            data = self.get_data()
+        except InvalidCursor:
+            raise Http404("Invalid cursor.")
+        return JsonResponse(data, json_dumps_params={"separators": (",", ":"), "ensure_ascii": False})
+
+    @abstractmethod
+    def get_data(self):
+        """レスポンスの JSON にする辞書を返す。self.fields に選ばれたフィールドだけを含める。"""
@@ -9,8 +9,22 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
 
-application = get_asgi_application()
+# django.core.asgi.get_asgi_application() と同じく初期化し，ストリーミングの本文を読める ASGIHandler を使う
+django.setup(set_prefix=False)
+
+# モデルを読み込むので，Django の初期化後に import する
+from mysite.streaming import ASGIHandler  # noqa: E402
+from tweets import stream  # noqa: E402
+
+django_application = ASGIHandler()
+
+
+async def application(scope, receive, send):
+    # Server-Sent Events の接続はスレッドを占有しないよう，Django を通さずに処理する
+    if scope["type"] == "http" and scope["path"] == stream.STREAM_PATH:
+        return await stream.application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,70 @@
+"""ユーザー・ツイートごとの名前空間付きキャッシュキーとバージョン管理。
+
+キャッシュする値のキーには対象のバージョンを含める。対象のデータが変わったときは
+bump_version() でバージョンを進めるだけで，古いバージョンのキーは参照されなくなり期限切れで消える。
+"""
+
+import uuid
+from functools import partial
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+USER = "user"
+TWEET = "tweet"
+# ユーザーが投稿したツイートの一覧。ツイートの投稿・削除と，それらのツイートへのいいねで進む
+AUTHOR = "author"
+
+
+def make_key(namespace, pk, *parts):
+    return ":".join([namespace, str(pk), *(str(part) for part in parts)])
+
+
+def user_key(user_id, *parts):
+    return make_key(USER, user_id, *parts)
+
+
+def _version_key(namespace, pk):
+    return make_key(namespace, pk, "version")
+
+
+def _new_version():
+    # キャッシュから追い出された後でも過去のバージョンと重ならないよう，連番ではなくランダムな値にする
+    return uuid.uuid4().hex
+
+
+def get_version(namespace, pk):
+    return cache.get_or_set(_version_key(namespace, pk), _new_version, None)
+
+
+def get_versions(namespace, pks):
+    keys = {_version_key(namespace, pk): pk for pk in pks}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    missing = {key: _new_version() for key, pk in keys.items() if pk not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update((keys[key], version) for key, version in missing.items())
+    return versions
+
+
+def is_shared():
+    """default のキャッシュが複数のプロセスで共有されるかを返す。LocMemCache はプロセスごとに別になる。"""
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def bump_version(namespace, pk):
+    bump_versions(namespace, [pk])
+
+
+def bump_versions(namespace, pks):
+    keys = [_version_key(namespace, pk) for pk in pks]
+    _set_new_versions(keys)
+    # コミット前の内容を読んだリクエストが新しいバージョンを持ち帰らないよう，コミット後にもう一度進める
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(partial(_set_new_versions, keys))
+
+
+def _set_new_versions(keys):
+    cache.set_many({key: _new_version() for key in keys}, None)
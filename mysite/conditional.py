@@ -0,0 +1,60 @@
+"""描画に使うデータのバージョンから ETag を作り，条件付き GET に 304 Not Modified で応える。
+
+バージョンは mysite.caching のもので，ツイート・いいね・フォローが変わるたびにシグナルなどで進められる。
+クライアントの If-None-Match が一致すれば，クエリセットの評価とテンプレートの描画を省略できる。
+
+バージョンは default のキャッシュに置くため，キャッシュがプロセスごとに別（LocMemCache）のときは ETag を付けない。
+他のプロセスで進んだバージョンが見えず，古い内容に 304 を返し続けてしまう。
+また，バージョンは最新の書き込みで進むので，ETag を付ける本文は遅れているかもしれないレプリカではなく default から読む。
+"""
+
+import hashlib
+from contextlib import nullcontext
+
+from django.contrib.messages import get_messages
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+
+from mysite import caching, routers
+
+
+class ConditionalGetMixin:
+    """get_etag_parts() が返す値から弱い ETag を作り，一致すれば 304 を返す。
+
+    get_etag_parts() は描画結果が変わるときに必ず変わる値のリストを返す。None を返すと常に描画する。
+    """
+
+    def get_etag_parts(self):
+        return None
+
+    def get_etag(self):
+        if not caching.is_shared():
+            return None
+        # 表示待ちのメッセージがあるときに 304 を返すと，メッセージが表示されない
+        if get_messages(self.request):
+            return None
+        parts = self.get_etag_parts()
+        if parts is None:
+            return None
+        # フォームの CSRF トークンはログインのたびに変わる。初回の描画で作られても ETag が変わらないよう先に作る
+        get_token(self.request)
+        parts = [self.request.user.pk, self.request.META["CSRF_COOKIE"], *parts]
+        return "W/" + quote_etag(hashlib.sha256(repr(parts).encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        with routers.read_from_default():
+            etag = self.get_etag()
+        response = get_conditional_response(request, etag=etag) if etag else None
+        if response is None:
+            with routers.read_from_default() if etag else nullcontext():
+                response = super().get(request, *args, **kwargs)
+                # テンプレートで評価されるクエリセットも同じデータベースから読むため，ここでレンダリングする
+                if hasattr(response, "render"):
+                    response.render()
+            if response.status_code != 200:
+                return response
+        if etag:
+            response.headers["ETag"] = etag
+        # 共有キャッシュには保存させず，ブラウザーには毎回検証させる
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,92 @@
+"""読み込み専用のビューのクエリをレプリカに振り分ける。
+
+ReplicaReadMixin を付けたビューの中で発行した読み込みだけが settings.DATABASE_REPLICAS の
+いずれかに送られ，それ以外の読み込みと全ての書き込みは default に送られる。
+ログイン中のユーザーが投稿・いいね・フォローなどの書き込みをした後は REPLICA_PIN_SECONDS 秒間
+レプリカを使わず，レプリカの遅延で自分の書き込みが見えなくなるのを防ぐ。
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+PIN_COOKIE_NAME = "replica_pin"
+
+_use_replica = ContextVar("use_replica", default=False)
+
+
+@contextmanager
+def read_from_replica(use_replica=True):
+    token = _use_replica.set(use_replica)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def read_from_default():
+    """ReplicaReadMixin の中でも，この中の読み込みは default に送る。"""
+    return read_from_replica(False)
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE_NAME, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカは default の複製なので，どのデータベースから読んだオブジェクト同士でも関連付けてよい
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """ビューの読み込みをレプリカに送る。書き込み直後のユーザーには default を使う。"""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD") or is_pinned(request):
+            return super().dispatch(request, *args, **kwargs)
+        with read_from_replica():
+            response = super().dispatch(request, *args, **kwargs)
+            # テンプレートで評価されるクエリセットもレプリカから読むため，ここでレンダリングする
+            if hasattr(response, "render"):
+                response.render()
+        return response
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    """ログイン中のユーザーの書き込みが成功したら，しばらくレプリカを使わないようにクッキーを設定する。"""
+
+    def process_response(self, request, response):
+        if (
+            request.method not in ("GET", "HEAD", "OPTIONS", "TRACE")
+            and response.status_code < 400
+            and request.user.is_authenticated
+        ):
+            response.set_cookie(
+                PIN_COOKIE_NAME,
+                str(time.time() + settings.REPLICA_PIN_SECONDS),
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -52,17 +53,30 @@ MIDDLEWARE = [
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
+    "mysite.routers.ReplicaPinMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
 ROOT_URLCONF = "mysite.urls"
 
+# テンプレートの読み込み方．DJANGO_TEMPLATE_PROFILE で選ぶ
+# development: 描画のたびにファイルを読み込んでパースし直す
+# production: cached.Loader でパース済みのテンプレートをプロセス内に保持する
+TEMPLATE_LOADERS = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+TEMPLATE_PROFILES = {
+    "development": {"loaders": TEMPLATE_LOADERS},
+    "production": {"loaders": [("django.template.loaders.cached.Loader", TEMPLATE_LOADERS)]},
+}
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
-        "APP_DIRS": True,
         "OPTIONS": {
+            **TEMPLATE_PROFILES[os.environ.get("DJANGO_TEMPLATE_PROFILE", "production")],
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
@@ -79,10 +93,81 @@ WSGI_APPLICATION = "mysite.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# 接続時に実行する PRAGMA の組み合わせ．DJANGO_SQLITE_PROFILE で選ぶ
+# production: WAL で読み込みと書き込みを並行させ，fsync を減らし，ページキャッシュと mmap を広げる
+SQLITE_PROFILES = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -65536,  # 負の値は KiB 単位（64 MiB）
+        "mmap_size": 268435456,  # 256 MiB
+        "temp_store": "MEMORY",
+    },
+}
+
+# CONN_MAX_AGE 秒の間はリクエストをまたいで接続を使い回し，再利用前に CONN_HEALTH_CHECKS で確認する
+# 閉じた接続は OPTIONS["pool"] のプールに戻り，同時接続数は max_size まで（空きを timeout 秒待つ）
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        "ENGINE": "mysite.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "CONN_MAX_AGE": int(os.environ.get("DJANGO_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "pragmas": SQLITE_PROFILES[os.environ.get("DJANGO_SQLITE_PROFILE", "default")],
+            "transaction_mode": "IMMEDIATE",
+            "pool": {
+                "max_size": int(os.environ.get("DJANGO_DB_POOL_SIZE", 10)),
+                "timeout": 10,
+            },
+        },
+    }
+}
+
+# DJANGO_DATABASE_REPLICAS にカンマ区切りで SQLite ファイルのパスを指定すると読み込み用のレプリカとして使う
+# （ローカルでは db.sqlite3 をコピーしたファイルで代用できる）。テストでは default をそのまま使う
+DATABASE_REPLICAS = []
+for index, path in enumerate(filter(None, os.environ.get("DJANGO_DATABASE_REPLICAS", "").split(","))):
+    alias = f"replica{index + 1}"
+    DATABASES[alias] = {**DATABASES["default"], "NAME": path, "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["mysite.routers.ReplicaRouter"]
+
+# 書き込みの後，この秒数はレプリカを使わずに default から読む
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+# DJANGO_CACHE_BACKEND で locmem（プロセス内）/ file / redis を切り替える
+# redis を使う場合は redis パッケージと，Redis 互換のサーバーがローカルに必要
+# locmem ではプロセス間でバージョンを共有できないため，条件付き GET の ETag（mysite.conditional）を付けない
+CACHE_BACKENDS = {
+    "locmem": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "mysite",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+    "file": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("DJANGO_FILE_CACHE_DIR", "/var/tmp/django_cache"),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+    "redis": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ.get("DJANGO_REDIS_URL", "redis://127.0.0.1:6379"),
+    },
+}
+
+CACHES = {
+    "default": {
+        **CACHE_BACKENDS[os.environ.get("DJANGO_CACHE_BACKEND", "locmem")],
+        "KEY_PREFIX": "mysite",
+        "TIMEOUT": 300,
     }
 }
 
@@ -134,3 +219,31 @@ LOGIN_REDIRECT_URL = "tweets:home"
 LOGOUT_REDIRECT_URL = "accounts:login"
 
 AUTH_USER_MODEL = "accounts.CustomUser"
+
+# request.user の読み込みをキャッシュ経由にする。ModelBackend は，それで作られた既存のセッションのために残す
+# （ログインは先頭のバックエンドで行われるため，新しいセッションは CachedModelBackend を使う）
+AUTHENTICATION_BACKENDS = ["accounts.backends.CachedModelBackend", "django.contrib.auth.backends.ModelBackend"]
+USER_CACHE_TIMEOUT = 300
+
+# セッションはキャッシュから読み，書き込みはデータベースにも行う
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
+# フォロー時に相手の過去ツイートをタイムラインへ取り込む件数
+TIMELINE_BACKFILL_SIZE = 200
+# フォロワー数がこの値以上のユーザーのツイートはファンアウトせず，読み込み時にマージする
+TIMELINE_FAN_OUT_THRESHOLD = 10000
+# この値を下回ったら update_celebrities でファンアウトに戻す。閾値付近を行き来するたびに書き込み直さないよう小さくする
+TIMELINE_DEMOTE_THRESHOLD = 9000
+
+# いいね一括更新 API で 1 リクエストに含められる操作数の上限
+LIKE_BATCH_MAX_OPERATIONS = 100
+
+# True にすると，いいね・取り消しをプロセス内のバッファにため，まとめてデータベースへ書き込む
+LIKE_WRITE_BEHIND = False
+# バッファを書き込む間隔（秒）．None の場合はバックグラウンドスレッドを使わない
+LIKE_BUFFER_FLUSH_INTERVAL = 1.0
+# バッファにたまった操作数がこの値に達したら間隔を待たずに書き込む
+LIKE_BUFFER_MAX_SIZE = 1000
+
+# Server-Sent Events（tweets.stream）で，この秒数の間に続いた変化を 1 回の配信にまとめる
+LIVE_COALESCE_INTERVAL = 0.5
@@ -0,0 +1,90 @@
+"""接続時に PRAGMA を設定する SQLite バックエンド。
+
+DATABASES の OPTIONS["pragmas"] に {名前: 値} を指定すると，新しい接続ごとに
+"PRAGMA 名前 = 値" を実行する。設定できる値は settings.SQLITE_PROFILES を参照。
+
+OPTIONS["pool"] に {"max_size": 件数, "timeout": 秒} を指定すると，閉じた接続を
+プールに戻して再利用し，同時に開く接続数を max_size までに制限する。
+インメモリのデータベースではプールを使わない。
+
+OPTIONS["transaction_mode"] に "IMMEDIATE" を指定すると，transaction.atomic が BEGIN IMMEDIATE で
+トランザクションを始める。既定の BEGIN（DEFERRED）では，読み込みの後に書き込もうとした接続どうしが
+busy_timeout を待たずに "database is locked" で失敗するため，並行して書き込む場合に指定する。
+"""
+
+import threading
+from functools import partial
+
+from django.db.backends.sqlite3 import base
+from django.utils.asyncio import async_unsafe
+
+from .pool import ConnectionPool, is_usable, on_thread_exit
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # 現在の接続を取り出したプール。接続後に NAME が差し替えられても（テスト用 DB など）正しいプールに返す
+    pool = None
+    # 接続を閉じずにスレッドが終了したとき（CONN_MAX_AGE で持ち越した接続など）にプールへ戻す finalize
+    release_on_thread_exit = None
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pragmas", None)
+        params.pop("pool", None)
+        params.pop("transaction_mode", None)
+        return params
+
+    def get_pool(self):
+        options = self.settings_dict["OPTIONS"].get("pool")
+        if not options or self.is_in_memory_db():
+            return None
+        key = (self.alias, str(self.settings_dict["NAME"]))
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = ConnectionPool(**options)
+            return _pools[key]
+
+    def _connect(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        apply_pragmas(conn, self.settings_dict["OPTIONS"].get("pragmas", {}))
+        return conn
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool()
+        if self.pool is None:
+            return self._connect(conn_params)
+        conn = self.pool.acquire(lambda: self._connect(conn_params))
+        self.release_on_thread_exit = on_thread_exit(partial(self.pool.release, conn))
+        return conn
+
+    def _close(self):
+        pool, self.pool = self.pool, None
+        if pool is None:
+            return super()._close()
+        self.release_on_thread_exit.detach()
+        # トランザクションの途中で閉じられた接続はプールに戻さない
+        with self.wrap_database_errors:
+            pool.release(self.connection, discard=self.in_atomic_block)
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict["OPTIONS"].get("transaction_mode")
+        self.cursor().execute(f"BEGIN {mode}" if mode else "BEGIN")
+
+    def is_usable(self):
+        return is_usable(self.connection)
@@ -0,0 +1,85 @@
+import queue
+import sqlite3
+import threading
+import weakref
+
+
+class ConnectionPool:
+    """同時に開く接続数を max_size に制限し，閉じられた接続を再利用するプール。
+
+    Django の接続はスレッドごとに作られるので，WSGI のワーカースレッドからも
+    ASGI の sync_to_async のスレッドからも同じプールを共有する。
+    """
+
+    def __init__(self, max_size, timeout):
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.max_size = max_size
+        self.timeout = timeout
+
+    def acquire(self, connect):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError(f"Connection pool exhausted ({self.max_size} connections in use).")
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return connect()
+                if is_usable(conn):
+                    return conn
+                conn.close()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            discard = True
+        if discard:
+            conn.close()
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    def idle_count(self):
+        return self._idle.qsize()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class _ThreadSentinel:
+    pass
+
+
+_thread_state = threading.local()
+
+
+def on_thread_exit(callback):
+    """現在のスレッドが終了したときに callback を呼ぶ weakref.finalize を返す。detach() で取り消せる。
+
+    スレッドのローカル変数は終了時に破棄されるので，そこに置いた参照の循環のないオブジェクトの finalize で知る。
+    """
+    try:
+        sentinel = _thread_state.sentinel
+    except AttributeError:
+        sentinel = _thread_state.sentinel = _ThreadSentinel()
+    finalizer = weakref.finalize(sentinel, callback)
+    finalizer.atexit = False
+    return finalizer
+
+
+def is_usable(conn):
+    try:
+        conn.execute("SELECT 1")
+    except sqlite3.Error:
+        return False
+    return True
@@ -0,0 +1,503 @@
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import time
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.views import View
+
+from accounts import export, follows
+from accounts.models import FriendShip
+from mysite import api, asgi, caching, routers
+from mysite.sqlite3.base import DatabaseWrapper, close_pools
+from tweets import likes, search, timeline
+from tweets.models import Like, TimelineEntry, Tweet
+from tweets.pagination import before_cursor
+
+CustomUser = get_user_model()
+
+
+class TestCaching(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_namespaced_keys(self):
+        self.assertEqual(caching.user_key(1, "profile"), "user:1:profile")
+        self.assertEqual(caching.make_key(caching.TWEET, 2, "version"), "tweet:2:version")
+
+    def test_bump_version(self):
+        version = caching.get_version(caching.TWEET, 1)
+        self.assertEqual(caching.get_version(caching.TWEET, 1), version)
+
+        caching.bump_version(caching.TWEET, 1)
+        self.assertNotEqual(caching.get_version(caching.TWEET, 1), version)
+
+    def test_get_versions(self):
+        version = caching.get_version(caching.USER, 1)
+        versions = caching.get_versions(caching.USER, [1, 2])
+        self.assertEqual(versions[1], version)
+        self.assertEqual(versions[2], caching.get_version(caching.USER, 2))
+
+        caching.bump_versions(caching.USER, [1, 2])
+        self.assertNotEqual(caching.get_versions(caching.USER, [1, 2]), versions)
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": "/tmp/mysite_test_cache",
+            }
+        }
+    )
+    def test_file_based_backend(self):
+        caching.bump_version(caching.TWEET, 1)
+        self.assertEqual(caching.get_version(caching.TWEET, 1), caching.get_version(caching.TWEET, 1))
+        cache.clear()
+
+
+class TestJsonApiView(SimpleTestCase):
+    def test_parse_fields(self):
+        self.assertEqual(api.parse_fields("", ("id", "content")), ("id", "content"))
+        self.assertEqual(api.parse_fields("content,id,content", ("id", "content")), ("content", "id"))
+        with self.assertRaises(api.InvalidFields):
+            api.parse_fields("id,password", ("id", "content"))
+
+    def test_get_data_is_required(self):
+        with self.assertRaises(TypeError):
+            api.JsonApiView()
+
+
+class TestSQLiteBackend(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "test.sqlite3"
+
+    def connect(self, pragmas):
+        settings_dict = {**connection.settings_dict, "NAME": self.path, "OPTIONS": {"pragmas": pragmas}}
+        wrapper = DatabaseWrapper(settings_dict, alias="pragma_test")
+        conn = wrapper.get_new_connection(wrapper.get_connection_params())
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_production_profile(self):
+        conn = self.connect(settings.SQLITE_PROFILES["production"])
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+        self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], 5000)
+        self.assertEqual(conn.execute("PRAGMA cache_size").fetchone()[0], -65536)
+        self.assertEqual(conn.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+
+    def test_default_profile(self):
+        conn = self.connect(settings.SQLITE_PROFILES["default"])
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+
+    def test_immediate_transaction_mode(self):
+        settings_dict = {**connection.settings_dict, "NAME": self.path, "OPTIONS": {"transaction_mode": "IMMEDIATE"}}
+        wrapper = DatabaseWrapper(settings_dict, alias="pragma_test")
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        wrapper._start_transaction_under_autocommit()
+        # BEGIN の時点で書き込みのロックを取るので，他の接続は書き込みを始められない
+        other = sqlite3.connect(self.path, timeout=0)
+        self.addCleanup(other.close)
+        with self.assertRaisesRegex(sqlite3.OperationalError, "locked"):
+            other.execute("BEGIN IMMEDIATE")
+        wrapper.connection.rollback()
+
+    def test_bench_sqlite_command(self):
+        out = StringIO()
+        call_command("bench_sqlite", duration=0.1, writers=1, readers=1, rows=10, stdout=out)
+        self.assertIn("default", out.getvalue())
+        self.assertIn("production", out.getvalue())
+
+
+class TestConnectionPool(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(close_pools)
+        self.settings_dict = {
+            **connection.settings_dict,
+            "NAME": Path(directory.name) / "test.sqlite3",
+            "OPTIONS": {"pool": {"max_size": 1, "timeout": 0.01}},
+        }
+
+    def connect(self):
+        wrapper = DatabaseWrapper(self.settings_dict, alias="pool_test")
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_reuses_closed_connection(self):
+        wrapper = self.connect()
+        conn = wrapper.connection
+        wrapper.close()
+        self.assertEqual(wrapper.get_pool().idle_count(), 1)
+        wrapper.connect()
+        self.assertIs(wrapper.connection, conn)
+
+    def test_pool_is_bounded(self):
+        wrapper = self.connect()
+        with self.assertRaises(OperationalError):
+            self.connect()
+        wrapper.close()
+        self.connect()
+
+    def test_releases_connection_of_finished_thread(self):
+        # CONN_MAX_AGE で接続を持ち越したまま終了したスレッドの分も，プールの枠に戻る
+        thread = threading.Thread(target=DatabaseWrapper(self.settings_dict, alias="pool_test").ensure_connection)
+        thread.start()
+        thread.join()
+        self.assertEqual(DatabaseWrapper(self.settings_dict, alias="pool_test").get_pool().idle_count(), 1)
+        self.connect()
+
+    def test_discards_unusable_connection(self):
+        wrapper = self.connect()
+        conn = wrapper.connection
+        conn.close()
+        self.assertFalse(wrapper.is_usable())
+        wrapper.close()
+        self.assertEqual(wrapper.get_pool().idle_count(), 0)
+        wrapper.connect()
+        self.assertIsNot(wrapper.connection, conn)
+        self.assertTrue(wrapper.is_usable())
+
+    def test_in_memory_database_is_not_pooled(self):
+        self.settings_dict["NAME"] = ":memory:"
+        self.assertIsNone(DatabaseWrapper(self.settings_dict, alias="pool_test").get_pool())
+
+
+class ReplicaProbeView(routers.ReplicaReadMixin, View):
+    def get(self, request):
+        return HttpResponse(str(routers.ReplicaRouter().db_for_read(Tweet)))
+
+    post = get
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"])
+class TestReplicaRouter(TestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_router(self):
+        self.assertIsNone(self.router.db_for_read(Tweet))
+        with routers.read_from_replica():
+            self.assertIn(self.router.db_for_read(Tweet), settings.DATABASE_REPLICAS)
+            self.assertEqual(self.router.db_for_write(Tweet), "default")
+        self.assertIsNone(self.router.db_for_read(Tweet))
+        self.assertFalse(self.router.allow_migrate("replica1", "tweets"))
+        self.assertIsNone(self.router.allow_migrate("default", "tweets"))
+
+    def test_read_only_view_uses_replica(self):
+        response = ReplicaProbeView.as_view()(self.factory.get("/"))
+        self.assertIn(response.content.decode(), settings.DATABASE_REPLICAS)
+        response = ReplicaProbeView.as_view()(self.factory.post("/"))
+        self.assertEqual(response.content.decode(), "None")
+
+    def test_pinned_request_uses_default(self):
+        request = self.factory.get("/")
+        request.COOKIES[routers.PIN_COOKIE_NAME] = str(time.time() + 5)
+        self.assertEqual(ReplicaProbeView.as_view()(request).content.decode(), "None")
+        request.COOKIES[routers.PIN_COOKIE_NAME] = str(time.time() - 1)
+        self.assertIn(ReplicaProbeView.as_view()(request).content.decode(), settings.DATABASE_REPLICAS)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_write_pins_user_to_default(self):
+        user = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        tweet = Tweet.objects.create(user=user, content="tweet01")
+        self.client.force_login(user)
+        response = self.client.get(reverse("tweets:home"))
+        self.assertNotIn(routers.PIN_COOKIE_NAME, response.cookies)
+        response = self.client.post(reverse("tweets:like", kwargs={"pk": tweet.pk}))
+        self.assertGreater(float(response.cookies[routers.PIN_COOKIE_NAME].value), time.time())
+
+
+class TestCacheInvalidationHooks(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        self.user2 = CustomUser.objects.create_user(username="testuser02", password="v6EaZYBT")
+        self.tweet = Tweet.objects.create(user=self.user2, content="tweet02")
+
+    def assertBumped(self, namespace, pk, action):
+        version = caching.get_version(namespace, pk)
+        action()
+        self.assertNotEqual(caching.get_version(namespace, pk), version)
+
+    def test_tweet_hooks(self):
+        self.assertBumped(caching.USER, self.user2.pk, lambda: Tweet.objects.create(user=self.user2, content="new"))
+        self.assertBumped(caching.AUTHOR, self.user2.pk, lambda: Tweet.objects.create(user=self.user2, content="new"))
+        self.assertBumped(caching.TWEET, self.tweet.pk, self.tweet.delete)
+
+    def test_like_hooks(self):
+        self.assertBumped(caching.TWEET, self.tweet.pk, lambda: likes.like(self.tweet, self.user1))
+        self.assertBumped(caching.USER, self.user1.pk, lambda: likes.unlike(self.tweet, self.user1))
+        self.assertBumped(caching.AUTHOR, self.user2.pk, lambda: likes.like(self.tweet, self.user1))
+        self.assertBumped(caching.AUTHOR, self.user2.pk, lambda: likes.unlike(self.tweet, self.user1))
+        self.assertBumped(
+            caching.TWEET, self.tweet.pk, lambda: likes.apply_batch(self.user1.pk, {self.tweet.pk: True})
+        )
+
+    @override_settings(LIKE_WRITE_BEHIND=True, LIKE_BUFFER_FLUSH_INTERVAL=None)
+    def test_buffered_like_hooks(self):
+        self.addCleanup(likes.flush_pending_likes)
+        self.assertBumped(caching.TWEET, self.tweet.pk, lambda: likes.like(self.tweet, self.user1))
+        self.assertBumped(caching.USER, self.user1.pk, lambda: likes.batch(self.user1, {self.tweet.pk: False}))
+
+    def test_friendship_hooks(self):
+        self.assertBumped(caching.USER, self.user1.pk, lambda: follows.follow(self.user1, self.user2))
+        self.assertBumped(caching.USER, self.user2.pk, lambda: follows.unfollow(self.user1, self.user2))
+
+    def test_user_hooks(self):
+        self.user1.username = "renamed"
+        self.assertBumped(caching.USER, self.user1.pk, self.user1.save)
+
+
+class TestQueryPlans(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf"USING (COVERING )?INDEX {index_name}\b")
+        self.assertNotIn("TEMP B-TREE", plan)
+        self.assertNotRegex(plan, r"\bSCAN\b")
+
+    def test_profile_tweets(self):
+        queryset = Tweet.objects.select_related("user").filter(user__username="testuser01").order_by("-created_at")
+        self.assertUsesIndex(queryset, "tweet_user_created_idx")
+
+    def test_follow_lists(self):
+        queryset = FriendShip.objects.select_related("followee").filter(follower=self.user).order_by("-created_at")
+        self.assertUsesIndex(queryset, "friendship_follower_idx")
+        queryset = FriendShip.objects.select_related("follower").filter(followee=self.user).order_by("-created_at")
+        self.assertUsesIndex(queryset, "friendship_followee_idx")
+
+    def test_timeline(self):
+        queryset = TimelineEntry.objects.filter(owner=self.user).order_by("-created_at", "-tweet_id")
+        self.assertUsesIndex(queryset, "timeline_owner_created_idx")
+        # owner から始まる索引があるので，外部キー単独の索引は作らない
+        constraints = connection.introspection.get_constraints(connection.cursor(), TimelineEntry._meta.db_table)
+        self.assertEqual(
+            sorted(
+                name
+                for name, constraint in constraints.items()
+                if not constraint["foreign_key"] and constraint["columns"][:1] == ["owner_id"]
+            ),
+            ["timeline_owner_created_idx", "unique_timeline_entry"],
+        )
+
+    def test_cursor_page(self):
+        # カーソル以降の範囲をインデックスで直接検索し，先頭から読み飛ばさない
+        queryset = (
+            FriendShip.objects.filter(follower=self.user)
+            .filter(before_cursor(timezone.now(), 1))
+            .order_by("-created_at", "-id")
+        )
+        self.assertUsesIndex(queryset, "friendship_follower_idx")
+        self.assertIn("created_at<?", queryset.explain())
+
+    def test_export(self):
+        # 書き出しは対象のユーザーのインデックスを順に読み，全件を並べ替えない
+        indexes = {
+            "tweets": "tweet_user_created_idx",
+            "likes": "like_user_tweet_idx",
+            "following": "friendship_follower_idx",
+            "followers": "friendship_followee_idx",
+        }
+        for kind, index_name in indexes.items():
+            self.assertUsesIndex(export.export_queryset(self.user, kind)[1], index_name)
+        tweet = Tweet.objects.create(user=self.user, content="tweet")
+        self.assertUsesIndex(export.export_queryset(self.user, "tweets", after=tweet.pk)[1], "tweet_user_created_idx")
+
+    def test_short_search_terms(self):
+        # 1〜2 文字の語でも tweets_tweet を全件読まず，bigram の索引から主キーで引く
+        for query in ("天気", "雨", "天気 雨"):
+            plan = search.search_tweets(query).explain()
+            self.assertIn("VIRTUAL TABLE INDEX", plan)
+            self.assertIn("SEARCH tweets_tweet USING INTEGER PRIMARY KEY", plan)
+            self.assertNotRegex(plan, r"SCAN tweets_tweet\b")
+
+    def test_likes_by_user(self):
+        self.assertUsesIndex(Like.objects.filter(user=self.user).values_list("tweet_id"), "like_user_tweet_idx")
+        queryset = Like.objects.filter(user=self.user, tweet__in=[1, 2]).values_list("tweet_id")
+        self.assertUsesIndex(queryset, "sqlite_autoindex_tweets_like_1")
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self):
+        # ETag はプロセス間で共有されるキャッシュを使うときだけ付ける
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        backend = "django.core.cache.backends.filebased.FileBasedCache"
+        shared_cache = override_settings(CACHES={"default": {"BACKEND": backend, "LOCATION": directory.name}})
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+        self.user1 = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        self.user2 = CustomUser.objects.create_user(username="testuser02", password="v6EaZYBT")
+        self.tweet = Tweet.objects.create(user=self.user2, content="tweet02")
+        follows.follow(self.user1, self.user2)
+        timeline.backfill(self.user1, self.user2)
+        self.client.force_login(self.user1)
+
+    def assertNotModified(self, url):
+        """2 回目の GET が 304 になり，1 回目より少ないクエリで済むことを確かめ，ETag を返す。"""
+        with CaptureQueriesContext(connection) as full:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+        etag = response["ETag"]
+        with CaptureQueriesContext(connection) as conditional:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertLess(len(conditional), len(full))
+        return etag
+
+    def assertModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_home(self):
+        url = reverse("tweets:home")
+        etag = self.assertNotModified(url)
+        likes.like(self.tweet, self.user2)
+        self.assertModified(url, etag)
+        etag = self.assertNotModified(url)
+        Tweet.objects.create(user=self.user2, content="new")
+        self.assertModified(url, etag)
+
+    def test_detail(self):
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+        etag = self.assertNotModified(url)
+        likes.like(self.tweet, self.user1)
+        self.assertModified(url, etag)
+        self.assertEqual(self.client.get(reverse("tweets:detail", kwargs={"pk": 1000})).status_code, 404)
+        self.assertIsNone(cache.get(caching.make_key(caching.TWEET, 1000, "version")))
+
+    def test_profile(self):
+        url = reverse("accounts:profile", kwargs={"username": "testuser02"})
+        etag = self.assertNotModified(url)
+        follows.unfollow(self.user1, self.user2)
+        self.assertModified(url, etag)
+        etag = self.assertNotModified(url)
+        likes.like(self.tweet, self.user2)
+        self.assertModified(url, etag)
+        # 第三者からのいいねでもいいね数が変わる
+        user3 = CustomUser.objects.create_user(username="testuser03", password="z6HqkuAR")
+        etag = self.assertNotModified(url)
+        likes.apply_batch(user3.pk, {self.tweet.pk: True})
+        self.assertModified(url, etag)
+        etag = self.assertNotModified(url)
+        likes.unlike(self.tweet, user3)
+        self.assertModified(url, etag)
+        etag = self.assertNotModified(url)
+        Tweet.objects.create(user=self.user2, content="new")
+        self.assertModified(url, etag)
+
+    def test_profile_etag_does_not_read_tweets(self):
+        # ツイートの件数が多くても，304 を返すまでにツイートを読まず，ツイートごとのバージョンも作らない
+        tweets = Tweet.objects.bulk_create(Tweet(user=self.user2, content=f"tweet{i}") for i in range(50))
+        url = reverse("accounts:profile", kwargs={"username": "testuser02"})
+        etag = self.client.get(url)["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries if "tweets_tweet" in query["sql"]])
+        self.assertFalse(cache.get_many([caching.make_key(caching.TWEET, tweet.pk, "version") for tweet in tweets]))
+
+    def test_etag_depends_on_viewer(self):
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+        etag = self.client.get(url)["ETag"]
+        self.client.force_login(self.user2)
+        self.assertModified(url, etag)
+
+    def test_no_etag_with_local_cache(self):
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("ETag"))
+
+    @override_settings(DATABASE_REPLICAS=["replica1"])
+    def test_etag_rendered_from_default(self):
+        # ETag を付ける本文は，最新の書き込みが反映されていないかもしれないレプリカから読まない
+        # （replica1 は存在しないデータベースなので，読み込めば失敗する）
+        for url in (
+            reverse("tweets:home"),
+            reverse("tweets:detail", kwargs={"pk": self.tweet.pk}),
+            reverse("accounts:profile", kwargs={"username": "testuser02"}),
+        ):
+            self.assertIn("ETag", self.client.get(url))
+
+    def test_versions_bumped_on_commit(self):
+        # コミット前に読んだ内容と，コミット後のバージョンを組み合わせない
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            likes.like(self.tweet, self.user1)
+            etag = self.client.get(url)["ETag"]
+        self.assertModified(url, etag)
+
+    def test_pending_messages_are_rendered(self):
+        url = reverse("tweets:home")
+        etag = self.client.get(url)["ETag"]
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "既にフォローしています。")
+
+
+class TestAsgiStreaming(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        Tweet.objects.bulk_create(Tweet(user=self.user, content=f"tweet{i}") for i in range(250))
+        self.client.force_login(self.user)
+
+    async def get(self, path, query_string):
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": query_string.encode(),
+            "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+        }
+        receive, messages = asyncio.Queue(), []
+        await receive.put({"type": "http.request"})
+
+        async def send(message):
+            messages.append(message)
+
+        await asyncio.wait_for(asgi.application(scope, receive.get, send), 10)
+        start, *body = messages
+        self.assertFalse(body[-1].get("more_body", False))
+        return start["status"], b"".join(message.get("body", b"") for message in body).decode()
+
+    async def test_profile(self):
+        status, content = await self.get(reverse("accounts:profile", kwargs={"username": "testuser01"}), "stream=1")
+        self.assertEqual(status, 200)
+        self.assertEqual(content.count('class="count_'), 250)
+        self.assertLess(content.index("<p>tweet249\n"), content.index("<p>tweet0\n"))
+        self.assertTrue(content.rstrip().endswith("</html>"))
+
+    async def test_export(self):
+        status, content = await self.get(reverse("accounts:export", kwargs={"kind": "tweets"}), "format=csv")
+        self.assertEqual(status, 200)
+        lines = content.splitlines()
+        self.assertEqual(lines[0], "id,created_at,content,like_count")
+        self.assertEqual(len(lines), 251)
+        self.assertIn(",tweet249,", lines[-1])
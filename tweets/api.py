@@ -0,0 +1,75 @@
+"""モバイルクライアント向けの読み込み専用の JSON API。
+
+values() で必要な列だけを取得し，モデルのインスタンスを作らずに JSON にする。
+ツイートの投稿者は user_id で表し，ユーザー名はレスポンスの "users": {ID: {"username": ...}} に一度だけ含める。
+?fields=id,content のように返すフィールドを選べ（mysite.api），一覧は ?before= のカーソルでページングする。
+"""
+
+from django.contrib.auth import get_user_model
+from django.http import Http404
+
+from mysite.api import JsonApiView
+
+from . import likes, timeline
+from .models import TimelineEntry, Tweet
+from .pagination import CursorPaginator
+
+CustomUser = get_user_model()
+
+# liked（閲覧者がいいね済みか）以外はデータベースの列
+TWEET_FIELDS = ("id", "user_id", "content", "created_at", "like_count", "liked")
+
+
+class TweetApiView(JsonApiView):
+    allowed_fields = TWEET_FIELDS
+    paginate_by = 20
+
+    @property
+    def columns(self):
+        return [field for field in self.fields if field != "liked"]
+
+    def serialize(self, tweets):
+        """values() の辞書を選ばれたフィールドだけの辞書にし，投稿者のユーザー名を users にまとめる。"""
+        if "like_count" in self.fields:
+            likes.merge_pending_like_count_values(tweets)
+        if "liked" in self.fields:
+            liked = likes.liked_ids(self.request.user, [tweet["id"] for tweet in tweets])
+            for tweet in tweets:
+                tweet["liked"] = tweet["id"] in liked
+        data = {"tweets": [{field: tweet[field] for field in self.fields} for tweet in tweets]}
+        if "user_id" in self.fields:
+            users = CustomUser.objects.filter(pk__in={tweet["user_id"] for tweet in tweets})
+            data["users"] = {pk: {"username": username} for pk, username in users.values_list("pk", "username")}
+        return data
+
+
+class HomeTimelineApiView(TweetApiView):
+    def get_data(self):
+        user = self.request.user
+        paginator = timeline.TimelinePaginator(
+            TimelineEntry.objects.filter(owner=user),
+            self.paginate_by,
+            celebrity_ids=timeline.celebrity_followee_ids(user),
+        )
+        page = paginator.page_values(self.request.GET.get("before"), self.columns)
+        return {**self.serialize(page.object_list), "next": page.next_cursor}
+
+
+class UserTweetsApiView(TweetApiView):
+    def get_data(self):
+        user_id = CustomUser.objects.filter(username=self.kwargs["username"]).values_list("pk", flat=True).first()
+        if user_id is None:
+            raise Http404("No user matches the given query.")
+        tweets = Tweet.objects.filter(user_id=user_id).values("id", "created_at", *self.columns)
+        page = CursorPaginator(tweets, self.paginate_by).page(self.request.GET.get("before"))
+        return {**self.serialize(page.object_list), "next": page.next_cursor}
+
+
+class TweetDetailApiView(TweetApiView):
+    def get_data(self):
+        tweet = Tweet.objects.filter(pk=self.kwargs["pk"]).values("id", *self.columns).first()
+        if tweet is None:
+            raise Http404("No Tweet matches the given query.")
+        data = self.serialize([tweet])
+        data["tweet"] = data.pop("tweets")[0]
+        return data
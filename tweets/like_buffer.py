@@ -0,0 +1,134 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer:
+    """いいね・取り消しの操作をプロセス内にため，まとめてデータベースへ書き込む。
+
+    操作は (tweet_id, user_id) ごとに (liked, was_liked) として保持する。was_liked は
+    データベースに未反映の操作がない状態でのいいね状態で，表示用のいいね数の差分の計算に使う。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushing = {}
+        self._flusher = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, tweet_id, user_id, liked, was_liked):
+        key = (tweet_id, user_id)
+        with self._lock:
+            if key in self._pending:
+                was_liked = self._pending[key][1]
+            elif key in self._flushing:
+                was_liked = self._flushing[key][0]
+            self._pending[key] = (liked, was_liked)
+            return len(self._pending)
+
+    def _merged(self):
+        merged = dict(self._flushing)
+        for key, (liked, was_liked) in self._pending.items():
+            merged[key] = (liked, self._flushing[key][1] if key in self._flushing else was_liked)
+        return merged
+
+    def like_count_deltas(self, tweet_ids):
+        tweet_ids = set(tweet_ids)
+        deltas = defaultdict(int)
+        with self._lock:
+            for (tweet_id, _), (liked, was_liked) in self._merged().items():
+                if tweet_id in tweet_ids:
+                    deltas[tweet_id] += int(liked) - int(was_liked)
+        return deltas
+
+    def liked_states(self, user_id, tweet_ids):
+        tweet_ids = set(tweet_ids)
+        with self._lock:
+            return {
+                tweet_id: liked
+                for (tweet_id, pending_user_id), (liked, _) in self._merged().items()
+                if pending_user_id == user_id and tweet_id in tweet_ids
+            }
+
+    def flush(self, apply):
+        """ためた操作を apply(user_id, {tweet_id: liked}) でユーザーごとに書き込み，書き込んだ操作数を返す。
+
+        書き込めなかったユーザーの操作だけを戻し，残りのユーザーを書き込んでから最初の例外を送出する。
+        """
+        with self._lock:
+            if self._flushing or not self._pending:
+                return 0
+            flushing, self._pending = self._pending, {}
+            self._flushing = flushing
+
+        operations = defaultdict(dict)
+        for (tweet_id, user_id), (liked, _) in flushing.items():
+            operations[user_id][tweet_id] = liked
+        flushed, error = 0, None
+        for user_id, user_operations in operations.items():
+            keys = [(tweet_id, user_id) for tweet_id in user_operations]
+            try:
+                apply(user_id, user_operations)
+            except Exception as e:
+                error = error or e
+                self._requeue(keys)
+            else:
+                # 書き込んだ操作はデータベースのいいね数に含まれるので，すぐに表示用の差分から外す
+                with self._lock:
+                    for key in keys:
+                        del self._flushing[key]
+                flushed += len(keys)
+        if error is not None:
+            raise error
+        return flushed
+
+    def _requeue(self, keys):
+        # 書き込めなかった操作は次回の flush で再度書き込む。was_liked はデータベースの状態のまま
+        with self._lock:
+            for key in keys:
+                liked, was_liked = self._flushing.pop(key)
+                if key in self._pending:
+                    liked = self._pending[key][0]
+                self._pending[key] = (liked, was_liked)
+
+    def start_flusher(self, apply, interval):
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = Flusher(self, apply, interval)
+                self._flusher.start()
+                atexit.register(self.flush, apply)
+            return self._flusher
+
+
+class Flusher(threading.Thread):
+    """interval 秒ごと，または wake() されたときに LikeBuffer を flush するバックグラウンドスレッド。"""
+
+    def __init__(self, buffer, apply, interval):
+        super().__init__(name="like-buffer-flusher", daemon=True)
+        self.buffer = buffer
+        self.apply = apply
+        self.interval = interval
+        self._wakeup = threading.Event()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.buffer.flush(self.apply)
+            except Exception:
+                logger.exception("Failed to flush buffered likes.")
+            finally:
+                close_old_connections()
@@ -0,0 +1,207 @@
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from mysite import caching
+
+from . import live
+from .like_buffer import LikeBuffer
+from .models import Like, Tweet
+
+# LIKE_WRITE_BEHIND が有効な場合に，データベースへ未反映のいいね・取り消しをためておくバッファ
+pending_likes = LikeBuffer()
+
+
+def _like_count(tweet_id):
+    return Tweet.objects.values_list("like_count", flat=True).get(pk=tweet_id)
+
+
+def _publish(like_counts):
+    # コミット後に，接続中のクライアントへ新しいいいね数を配信する
+    transaction.on_commit(partial(live.broker.publish_like_counts, like_counts))
+
+
+def like(tweet, user):
+    """いいねを登録し，更新後のいいね数を返す。既にいいね済みなら何もしない。"""
+    if settings.LIKE_WRITE_BEHIND:
+        like_count = _enqueue(tweet, user, True)
+    else:
+        like_count = _like(tweet, user)
+    _publish({tweet.pk: like_count})
+    return like_count
+
+
+def unlike(tweet, user):
+    """いいねを取り消し，更新後のいいね数を返す。いいねしていなければ何もしない。"""
+    if settings.LIKE_WRITE_BEHIND:
+        like_count = _enqueue(tweet, user, False)
+    else:
+        like_count = _unlike(tweet, user)
+    _publish({tweet.pk: like_count})
+    return like_count
+
+
+# 非同期のビュー用。Django 4.1 には非同期のトランザクションがないため，いいね数の更新を含む書き込みはスレッドで実行する
+alike = sync_to_async(like)
+aunlike = sync_to_async(unlike)
+
+
+def batch(user, operations):
+    """{tweet_id: liked} をまとめて反映し，{tweet_id: like_count} を返す。存在しないツイートは含まれない。"""
+    if not settings.LIKE_WRITE_BEHIND:
+        like_counts = apply_batch(user.pk, operations)
+        _publish(like_counts)
+        return like_counts
+    like_counts = dict(Tweet.objects.filter(pk__in=operations).values_list("pk", "like_count"))
+    liked = set(Like.objects.filter(user=user, tweet_id__in=like_counts).values_list("tweet_id", flat=True))
+    for tweet_id in like_counts:
+        pending_likes.add(tweet_id, user.pk, operations[tweet_id], tweet_id in liked)
+    _bump_versions(user.pk, list(like_counts))
+    _schedule_flush()
+    deltas = pending_likes.like_count_deltas(like_counts)
+    like_counts = {tweet_id: like_count + deltas[tweet_id] for tweet_id, like_count in like_counts.items()}
+    _publish(like_counts)
+    return like_counts
+
+
+def _enqueue(tweet, user, liked):
+    was_liked = Like.objects.filter(tweet=tweet, user=user).exists()
+    pending_likes.add(tweet.pk, user.pk, liked, was_liked)
+    _bump_versions(user.pk, [tweet.pk])
+    _schedule_flush()
+    return tweet.like_count + pending_likes.like_count_deltas([tweet.pk])[tweet.pk]
+
+
+def _bump_versions(user_id, tweet_ids):
+    # 表示するいいね数といいね状態が変わったことを，条件付き GET の ETag などに伝える
+    caching.bump_versions(caching.TWEET, tweet_ids)
+    caching.bump_version(caching.USER, user_id)
+    caching.bump_versions(
+        caching.AUTHOR, set(Tweet.objects.filter(pk__in=tweet_ids).values_list("user_id", flat=True))
+    )
+
+
+def _schedule_flush():
+    interval = settings.LIKE_BUFFER_FLUSH_INTERVAL
+    if interval is None:
+        # バックグラウンドスレッドを使わない場合は，あふれたときにリクエスト内で書き込む
+        if len(pending_likes) >= settings.LIKE_BUFFER_MAX_SIZE:
+            flush_pending_likes()
+        return
+    flusher = pending_likes.start_flusher(apply_batch, interval)
+    if len(pending_likes) >= settings.LIKE_BUFFER_MAX_SIZE:
+        flusher.wake()
+
+
+def flush_pending_likes():
+    return pending_likes.flush(apply_batch)
+
+
+@transaction.atomic
+def _like(tweet, user):
+    _, created = Like.objects.get_or_create(tweet=tweet, user=user)
+    if created:
+        Tweet.objects.filter(pk=tweet.pk).update(like_count=F("like_count") + 1)
+    return _like_count(tweet.pk)
+
+
+@transaction.atomic
+def _unlike(tweet, user):
+    deleted, _ = Like.objects.filter(tweet=tweet, user=user).delete()
+    if deleted:
+        Tweet.objects.filter(pk=tweet.pk).update(like_count=F("like_count") - 1)
+    return _like_count(tweet.pk)
+
+
+@transaction.atomic
+def apply_batch(user_id, operations):
+    tweet_ids = set(Tweet.objects.filter(pk__in=operations).values_list("pk", flat=True))
+    liked = set(Like.objects.filter(user_id=user_id, tweet_id__in=tweet_ids).values_list("tweet_id", flat=True))
+    to_like = [pk for pk in tweet_ids if operations[pk] and pk not in liked]
+    to_unlike = [pk for pk in tweet_ids if not operations[pk] and pk in liked]
+
+    to_like = _create_likes(user_id, to_like)
+    to_unlike = _delete_likes(user_id, to_unlike)
+    Tweet.objects.filter(pk__in=to_like).update(like_count=F("like_count") + 1)
+    Tweet.objects.filter(pk__in=to_unlike).update(like_count=F("like_count") - 1)
+    # bulk_create と delete はシグナルを送らないことがあるため，ここでバージョンを進める
+    _bump_versions(user_id, to_like + to_unlike)
+    return dict(Tweet.objects.filter(pk__in=tweet_ids).values_list("pk", "like_count"))
+
+
+def _create_likes(user_id, tweet_ids):
+    """いいねをまとめて登録し，実際に登録したツイートの id を返す。"""
+    try:
+        with transaction.atomic():
+            Like.objects.bulk_create([Like(tweet_id=pk, user_id=user_id) for pk in tweet_ids])
+        return tweet_ids
+    except IntegrityError:
+        # 並行するいいねと重なった場合は 1 件ずつ登録し，既にあったものはいいね数に数えない
+        return [pk for pk in tweet_ids if Like.objects.get_or_create(tweet_id=pk, user_id=user_id)[1]]
+
+
+def _delete_likes(user_id, tweet_ids):
+    """いいねをまとめて削除し，実際に削除したツイートの id を返す。"""
+    likes = Like.objects.filter(user_id=user_id)
+    sid = transaction.savepoint()
+    deleted, _ = likes.filter(tweet_id__in=tweet_ids).delete()
+    if deleted == len(tweet_ids):
+        transaction.savepoint_commit(sid)
+        return tweet_ids
+    # 並行する取り消しと重なった場合は 1 件ずつ削除し直し，既になかったものはいいね数に数えない
+    transaction.savepoint_rollback(sid)
+    return [pk for pk in tweet_ids if likes.filter(tweet_id=pk).delete()[0]]
+
+
+def liked_tweet_ids(user, tweets):
+    """表示するツイートのうち user がいいね済みのものの id を集合で返す。"""
+    return liked_ids(user, [tweet.pk for tweet in tweets])
+
+
+def liked_ids(user, tweet_ids):
+    """liked_tweet_ids() の ID 版。"""
+    if not tweet_ids:
+        return set()
+    liked = set(Like.objects.filter(user=user, tweet_id__in=tweet_ids).values_list("tweet_id", flat=True))
+    if settings.LIKE_WRITE_BEHIND:
+        for tweet_id, is_liked in pending_likes.liked_states(user.pk, tweet_ids).items():
+            (liked.add if is_liked else liked.discard)(tweet_id)
+    return liked
+
+
+def merge_pending_like_counts(tweets):
+    """データベースに未反映のいいね・取り消しを表示するツイートの like_count に反映する。"""
+    if not settings.LIKE_WRITE_BEHIND:
+        return
+    deltas = pending_likes.like_count_deltas(tweet.pk for tweet in tweets)
+    for tweet in tweets:
+        tweet.like_count += deltas.get(tweet.pk, 0)
+
+
+def merge_pending_like_count_values(tweets):
+    """merge_pending_like_counts() の values() の辞書版。"""
+    if not settings.LIKE_WRITE_BEHIND:
+        return
+    deltas = pending_likes.like_count_deltas(tweet["id"] for tweet in tweets)
+    for tweet in tweets:
+        tweet["like_count"] += deltas.get(tweet["id"], 0)
+
+
+def actual_like_count():
+    like_count = Like.objects.filter(tweet=OuterRef("pk")).values("tweet").annotate(count=Count("pk")).values("count")
+    return Coalesce(Subquery(like_count), 0)
+
+
+def reconcile_like_counts(queryset=None):
+    """like_count を Like の実際の件数に合わせ，修正した件数を返す。"""
+    queryset = Tweet.objects.all() if queryset is None else queryset
+    with transaction.atomic():
+        drifted = list(
+            queryset.annotate(actual=actual_like_count()).exclude(like_count=F("actual")).values_list("pk", flat=True)
+        )
+        Tweet.objects.filter(pk__in=drifted).update(like_count=actual_like_count())
+    return len(drifted)
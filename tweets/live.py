@@ -0,0 +1,88 @@
+"""いいね数の変化と新しいツイートを，接続中のクライアントへ配信するためのプロセス内の pub/sub。
+
+publish_* はリクエストを処理するスレッドから呼ばれ，Subscription はイベントループ上で変化を待つ。
+短い間に続けて届いた変化は coalesce_interval 秒まとめ，ツイートごとの最新のいいね数と新しいツイートの件数にして渡す。
+"""
+
+import asyncio
+import threading
+
+from django.conf import settings
+
+
+class Subscription:
+    def __init__(self, loop, followee_ids, tweet_ids, coalesce_interval=None):
+        self.loop = loop
+        self.followee_ids = set(followee_ids)
+        self.tweet_ids = set(tweet_ids)
+        if coalesce_interval is None:
+            coalesce_interval = settings.LIVE_COALESCE_INTERVAL
+        self.coalesce_interval = coalesce_interval
+        self._lock = threading.Lock()
+        self._like_counts = {}
+        self._new_tweets = 0
+        self._ready = asyncio.Event()
+
+    def add_like_counts(self, like_counts):
+        like_counts = {tweet_id: count for tweet_id, count in like_counts.items() if tweet_id in self.tweet_ids}
+        if not like_counts:
+            return
+        with self._lock:
+            self._like_counts.update(like_counts)
+        self._notify()
+
+    def add_new_tweet(self, author_id):
+        if author_id not in self.followee_ids:
+            return
+        with self._lock:
+            self._new_tweets += 1
+        self._notify()
+
+    def _notify(self):
+        self.loop.call_soon_threadsafe(self._ready.set)
+
+    async def get(self, timeout):
+        """変化を待って {"like_counts": {...}, "new_tweets": 件数} を返す。timeout 秒変化がなければ None を返す。"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        await asyncio.sleep(self.coalesce_interval)
+        self._ready.clear()
+        with self._lock:
+            changes = {"like_counts": self._like_counts, "new_tweets": self._new_tweets}
+            self._like_counts, self._new_tweets = {}, 0
+        return changes
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def _deliver(self, method, *args):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                getattr(subscription, method)(*args)
+            except RuntimeError:
+                # イベントループが既に閉じている
+                self.unsubscribe(subscription)
+
+    def publish_like_counts(self, like_counts):
+        self._deliver("add_like_counts", like_counts)
+
+    def publish_new_tweet(self, author_id):
+        self._deliver("add_new_tweet", author_id)
+
+
+broker = Broker()
@@ -0,0 +1,124 @@
+import asyncio
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from mysite.sqlite3.base import close_pools
+from tweets.models import Tweet
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "いいね・フォローのリクエストを WSGI（ワーカースレッドごとに 1 リクエスト）と"
+        " ASGI（1 つのイベントループ）で並行に処理し，スループットとレイテンシを比べます。"
+        "計測には一時ファイルに作ったテスト用データベースを使います。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50, help="並行してリクエストを送るユーザー数")
+        parser.add_argument("--requests", type=int, default=20, help="ユーザーごとのリクエスト数")
+        parser.add_argument("--threads", type=int, default=4, help="WSGI のワーカースレッド数")
+
+    def handle(self, *args, **options):
+        test_settings = connection.settings_dict["TEST"]
+        test_name = test_settings.get("NAME")
+        setup_test_environment()
+        with tempfile.TemporaryDirectory() as directory:
+            test_settings["NAME"] = str(Path(directory) / "bench.sqlite3")
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                users = self.populate(options["users"])
+                self.stdout.write(
+                    f"users={options['users']} requests/user={options['requests']} wsgi_threads={options['threads']}"
+                )
+                sessions = self.sessions(users, options["requests"], Client)
+                self.report("wsgi", *self.run_wsgi(sessions, options["threads"]))
+                sessions = self.sessions(users, options["requests"], AsyncClient)
+                self.report("asgi", *asyncio.run(self.run_asgi(sessions)))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                close_pools()
+                test_settings["NAME"] = test_name
+                teardown_test_environment()
+
+    def populate(self, count):
+        users = CustomUser.objects.bulk_create(CustomUser(username=f"bench{i}") for i in range(count))
+        Tweet.objects.bulk_create(Tweet(user=user, content=f"tweet by {user.username}") for user in users)
+        return list(CustomUser.objects.filter(username__startswith="bench").prefetch_related("tweet_set"))
+
+    def sessions(self, users, count, client_class):
+        # ユーザーごとに，他のユーザーのツイートへのいいね・取り消しとフォロー・解除を順に繰り返す
+        sessions = []
+        for index, user in enumerate(users):
+            client = client_class()
+            client.force_login(user)
+            paths = []
+            for step in range(count):
+                target = users[(index + step // 4 + 1) % len(users)]
+                tweet = target.tweet_set.all()[0]
+                paths.append(
+                    [
+                        reverse("tweets:like", kwargs={"pk": tweet.pk}),
+                        reverse("tweets:unlike", kwargs={"pk": tweet.pk}),
+                        reverse("accounts:follow", kwargs={"username": target.username}),
+                        reverse("accounts:unfollow", kwargs={"username": target.username}),
+                    ][step % 4]
+                )
+            sessions.append((client, paths))
+        return sessions
+
+    def run_wsgi(self, sessions, threads):
+        def run_session(session):
+            client, paths = session
+            latencies, errors = [], 0
+            for path in paths:
+                started = time.perf_counter()
+                response = client.post(path)
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code >= 400
+            connection.close()
+            return latencies, errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            results = list(executor.map(run_session, sessions))
+        return results, time.perf_counter() - started
+
+    async def run_asgi(self, sessions):
+        async def run_session(session):
+            client, paths = session
+            latencies, errors = [], 0
+            for path in paths:
+                started = time.perf_counter()
+                response = await client.post(path)
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code >= 400
+            return latencies, errors
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(run_session(session) for session in sessions))
+        elapsed = time.perf_counter() - started
+        # 非同期のビューが使った接続は sync_to_async のスレッドにあるので，そのスレッドで閉じる
+        await sync_to_async(lambda: connection.close())()
+        return results, elapsed
+
+    def report(self, mode, results, elapsed):
+        latencies = sorted(latency for session_latencies, _ in results for latency in session_latencies)
+        errors = sum(session_errors for _, session_errors in results)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(
+            f"{mode:<5} requests/s={len(latencies) / elapsed:>8.1f} p50={p50 * 1000:>7.1f}ms "
+            f"p99={p99 * 1000:>7.1f}ms errors={errors}"
+        )
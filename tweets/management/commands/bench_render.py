@@ -0,0 +1,83 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.template.backends.django import DjangoTemplates
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from tweets.models import Tweet
+from tweets.pagination import CursorPage
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "テンプレートのプロファイルごとに，ツイートを並べたホームの描画時間を計測します。"
+        "データベースは使わず，保存していないツイートを描画します。"
+    )
+
+    # フラグメントキャッシュとバージョンは使い捨てのキャッシュに作り，セッションなどを置く default は消さない
+    bench_caches = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "bench_render"}
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", nargs="+", default=list(settings.TEMPLATE_PROFILES))
+        parser.add_argument("--tweets", type=int, default=100, help="1 ページに並べるツイート数")
+        parser.add_argument("--iterations", type=int, default=200, help="プロファイルごとの描画回数")
+
+    def handle(self, *args, **options):
+        for profile in options["profiles"]:
+            if profile not in settings.TEMPLATE_PROFILES:
+                raise CommandError(f"TEMPLATE_PROFILES に {profile} がありません。")
+        request, context = self.build_context(options["tweets"])
+        self.stdout.write(f"tweets={options['tweets']} iterations={options['iterations']}")
+        with override_settings(CACHES=self.bench_caches):
+            for profile in options["profiles"]:
+                self.bench(profile, request, context, options["iterations"])
+            cache.clear()
+
+    def bench(self, profile, request, context, iterations):
+        engine = self.build_engine(profile)
+        # ツイートごとのフラグメントキャッシュは 1 回目の描画で作られる
+        cache.clear()
+        started = time.perf_counter()
+        engine.get_template("tweets/home.html").render(context, request)
+        first = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(iterations):
+            # ビューと同じく，描画のたびにテンプレートを取得する
+            engine.get_template("tweets/home.html").render(context, request)
+        mean = (time.perf_counter() - started) / iterations
+        self.stdout.write(f"{profile:<12} first={first * 1000:>7.2f}ms mean={mean * 1000:>7.2f}ms")
+
+    def build_engine(self, profile):
+        context_processors = settings.TEMPLATES[0]["OPTIONS"]["context_processors"]
+        return DjangoTemplates(
+            {
+                "NAME": f"bench_{profile}",
+                "DIRS": settings.TEMPLATES[0]["DIRS"],
+                "APP_DIRS": False,
+                "OPTIONS": {**settings.TEMPLATE_PROFILES[profile], "context_processors": context_processors},
+            }
+        )
+
+    def build_context(self, count):
+        user = CustomUser(pk=1, username="bench")
+        now = timezone.now()
+        tweets = [
+            Tweet(pk=pk, user=user, content=f"tweet {pk}", created_at=now, like_count=pk) for pk in range(1, count + 1)
+        ]
+        request = RequestFactory().get(reverse("tweets:home"))
+        request.user = user
+        context = {
+            "tweet_list": tweets,
+            "liked_tweet_ids": {tweet.pk for tweet in tweets[::2]},
+            "page_obj": CursorPage(tweets),
+        }
+        return request, context
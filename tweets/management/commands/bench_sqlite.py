@@ -0,0 +1,109 @@
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from mysite.sqlite3.base import apply_pragmas
+
+SCHEMA = """
+CREATE TABLE tweet (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX tweet_created_at_id_idx ON tweet (created_at DESC, id DESC);
+"""
+INSERT = "INSERT INTO tweet (user_id, content, created_at) VALUES (?, ?, ?)"
+SELECT = "SELECT id, user_id, content, created_at FROM tweet ORDER BY created_at DESC, id DESC LIMIT 20"
+
+
+class Command(BaseCommand):
+    help = (
+        "SQLite の PRAGMA プロファイルごとに，ツイート投稿とタイムライン読み込みを並行させたスループットを計測します。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", nargs="+", default=list(settings.SQLITE_PROFILES))
+        parser.add_argument("--writers", type=int, default=4, help="書き込みスレッド数")
+        parser.add_argument("--readers", type=int, default=8, help="読み込みスレッド数")
+        parser.add_argument("--duration", type=float, default=5.0, help="プロファイルごとの計測秒数")
+        parser.add_argument("--rows", type=int, default=10000, help="計測前に投入しておくツイート数")
+
+    def handle(self, *args, **options):
+        for profile in options["profiles"]:
+            if profile not in settings.SQLITE_PROFILES:
+                raise CommandError(f"SQLITE_PROFILES に {profile} がありません。")
+        self.stdout.write(f"writers={options['writers']} readers={options['readers']} duration={options['duration']}s")
+        for profile in options["profiles"]:
+            pragmas = settings.SQLITE_PROFILES[profile]
+            with tempfile.TemporaryDirectory() as directory:
+                result = self.run_profile(Path(directory) / "bench.sqlite3", pragmas, options)
+            self.stdout.write(
+                f"{profile:<12} writes/s={result['writes']:>9.1f} reads/s={result['reads']:>9.1f} "
+                f"busy_errors={result['errors']}"
+            )
+
+    def connect(self, path, pragmas):
+        # Django の sqlite3 バックエンドと同じく busy 時は 5 秒まで待つ
+        conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        apply_pragmas(conn, pragmas)
+        return conn
+
+    def run_profile(self, path, pragmas, options):
+        conn = self.connect(path, pragmas)
+        conn.executescript(SCHEMA)
+        now = timezone.now().isoformat()
+        conn.execute("BEGIN")
+        conn.executemany(INSERT, ((i % 100, f"tweet {i}", now) for i in range(options["rows"])))
+        conn.execute("COMMIT")
+        conn.close()
+
+        stop = threading.Event()
+        counts = {"writes": 0, "reads": 0, "errors": 0}
+        lock = threading.Lock()
+
+        def write():
+            conn = self.connect(path, pragmas)
+            while not stop.is_set():
+                try:
+                    conn.execute("BEGIN")
+                    conn.execute(INSERT, (1, "benchmark", timezone.now().isoformat()))
+                    conn.execute("COMMIT")
+                    key = "writes"
+                except sqlite3.OperationalError:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    key = "errors"
+                with lock:
+                    counts[key] += 1
+            conn.close()
+
+        def read():
+            conn = self.connect(path, pragmas)
+            while not stop.is_set():
+                try:
+                    conn.execute(SELECT).fetchall()
+                    key = "reads"
+                except sqlite3.OperationalError:
+                    key = "errors"
+                with lock:
+                    counts[key] += 1
+            conn.close()
+
+        threads = [threading.Thread(target=write) for _ in range(options["writers"])]
+        threads += [threading.Thread(target=read) for _ in range(options["readers"])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options["duration"])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return {"writes": counts["writes"] / elapsed, "reads": counts["reads"] / elapsed, "errors": counts["errors"]}
@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tweets import timeline
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "フォローグラフからユーザーのタイムラインを作り直します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("usernames", nargs="*", help="対象のユーザー名（省略時は全ユーザー）")
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.order_by("pk")
+        if options["usernames"]:
+            users = users.filter(username__in=options["usernames"])
+        count = 0
+        for user in users.iterator():
+            with transaction.atomic():
+                timeline.rebuild(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"{count} 件のタイムラインを作り直しました。"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from tweets.likes import reconcile_like_counts
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "Tweet.like_count を Like の実際の件数に合わせて修正します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000, help="1 トランザクションで確認するツイート数")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        fixed = 0
+        last_pk = 0
+        while True:
+            pks = list(Tweet.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+            fixed += reconcile_like_counts(Tweet.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]))
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS(f"{fixed} 件のいいね数を修正しました。"))
@@ -0,0 +1,195 @@
+import random
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import FriendShip
+from tweets import timeline
+from tweets.models import Like, Tweet
+
+CustomUser = get_user_model()
+
+# rebuild_timelines() で pk__in に渡す主キーの数。SQLite のパラメーター数の上限（999）に収める
+USER_BATCH_SIZE = 500
+
+
+def skewed_index(rng, n, skew):
+    """[0, n) の添字を，小さい添字ほど選ばれやすいべき分布で返す。
+
+    skew が 1 なら一様で，大きいほど偏る（skew=3 なら上位 1% に約 2 割が集まる）。
+    """
+    return int(n * rng.random() ** skew)
+
+
+def max_sample_size(n, exclude=False):
+    """sample_skewed() で選べる個数の上限。選び直しが増えすぎないよう，候補の半分までにする。"""
+    return (n - exclude) // 2
+
+
+def sample_skewed(rng, n, k, skew, exclude=None):
+    """[0, n) から重複なしに k 個の添字を skewed_index() で選ぶ。k は max_sample_size() 以下にする。"""
+    if k > max_sample_size(n, exclude is not None):
+        raise ValueError(f"cannot sample {k} of {n} indexes.")
+    indexes = set()
+    while len(indexes) < k:
+        index = skewed_index(rng, n, skew)
+        if index != exclude:
+            indexes.add(index)
+    return sorted(indexes)
+
+
+@contextmanager
+def explicit_created_at(*models):
+    # bulk_create でも auto_now_add は保存時の時刻で上書きするため，生成した投稿日を使う間だけ無効にする
+    fields = [model._meta.get_field("created_at") for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        "ベンチマーク用に，ユーザー・べき分布のフォローグラフ・ツイート・偏りのあるいいねを一括で投入します。"
+        "同じ --seed なら同じグラフになります。投入後にフォロー数・いいね数を修正し，タイムラインを作ります。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="ユーザー数")
+        parser.add_argument("--follows", type=int, default=50, help="1 人あたりの平均フォロー数")
+        parser.add_argument("--tweets", type=int, default=10000, help="ツイート数")
+        parser.add_argument("--likes", type=int, default=20, help="1 人あたりの平均いいね数")
+        parser.add_argument("--skew", type=float, default=3.0, help="フォロー・ツイート・いいねの偏り（1 で一様）")
+        parser.add_argument("--days", type=int, default=30, help="投稿日を散らばらせる日数")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--prefix", default="seed", help="ユーザー名の接頭辞")
+        parser.add_argument("--password", default="password", help="全ユーザー共通のパスワード")
+        parser.add_argument("--batch-size", type=int, default=10000, help="1 トランザクションで投入する行数")
+        parser.add_argument("--skip-timelines", action="store_true", help="タイムラインを作らない")
+
+    def handle(self, *args, **options):
+        if options["users"] < 2:
+            raise CommandError("--users は 2 以上を指定してください。")
+        # 1 人あたり平均の 2 倍まで選ぶので，その数が候補から選べる上限を超えないようにする
+        max_follows = max_sample_size(options["users"], exclude=True) // 2
+        if options["follows"] > max_follows:
+            raise CommandError(f"--follows は {max_follows} 以下を指定してください。")
+        max_likes = max_sample_size(options["tweets"]) // 2
+        if options["tweets"] and options["likes"] > max_likes:
+            raise CommandError(f"--likes は {max_likes} 以下を指定してください。")
+        if CustomUser.objects.filter(username=f"{options['prefix']}0").exists():
+            raise CommandError(f"{options['prefix']}0 は既に存在します。--prefix を変えてください。")
+        self.batch_size = options["batch_size"]
+        self.now = timezone.now()
+        self.span = timedelta(days=options["days"])
+        # 種類ごとに乱数を分け，件数を変えても他の種類の生成結果が変わらないようにする
+        rngs = {name: random.Random(f"{options['seed']}:{name}") for name in ("follows", "tweets", "likes")}
+
+        with explicit_created_at(Tweet, FriendShip):
+            user_ids = self.run("users", lambda: self.create_users(options))
+            self.run("friendships", lambda: self.create_friendships(rngs["follows"], user_ids, options))
+            tweet_ids = self.run("tweets", lambda: self.create_tweets(rngs["tweets"], user_ids, options))
+            self.run("likes", lambda: self.create_likes(rngs["likes"], user_ids, tweet_ids, options))
+
+        call_command("repair_follow_counts", stdout=self.stdout)
+        call_command("reconcile_like_counts", stdout=self.stdout)
+        call_command("update_celebrities", stdout=self.stdout)
+        if not options["skip_timelines"]:
+            self.run("timelines", lambda: self.rebuild_timelines(user_ids))
+
+    def run(self, name, create):
+        started = time.perf_counter()
+        pks = create()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{name:<12} rows={len(pks):>10} elapsed={elapsed:>8.1f}s rows/s={len(pks) / elapsed:>10.0f}"
+        )
+        return pks
+
+    def insert(self, model, rows):
+        """rows を batch_size 件ずつトランザクションで投入し，投入した主キーを返す。"""
+        pks = array("q")
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                pks.extend(self._insert_batch(model, batch))
+                batch = []
+        if batch:
+            pks.extend(self._insert_batch(model, batch))
+        return pks
+
+    def _insert_batch(self, model, batch):
+        with transaction.atomic():
+            return [obj.pk for obj in model.objects.bulk_create(batch)]
+
+    def timestamp(self, index, count):
+        # 添字の順に古い投稿日から並べる
+        return self.now - self.span + self.span * (index / count)
+
+    def create_users(self, options):
+        password = make_password(options["password"])
+        prefix = options["prefix"]
+        return self.insert(
+            CustomUser, (CustomUser(username=f"{prefix}{i}", password=password) for i in range(options["users"]))
+        )
+
+    def create_friendships(self, rng, user_ids, options):
+        # フォローする人数は一様に，フォローされる相手は添字の小さいユーザーに偏らせる
+        n = len(user_ids)
+
+        def rows():
+            for index, follower_id in enumerate(user_ids):
+                for followee in sample_skewed(rng, n, rng.randint(0, 2 * options["follows"]), options["skew"], index):
+                    yield FriendShip(
+                        follower_id=follower_id, followee_id=user_ids[followee], created_at=self.timestamp(index, n)
+                    )
+
+        return self.insert(FriendShip, rows())
+
+    def create_tweets(self, rng, user_ids, options):
+        n, count = len(user_ids), options["tweets"]
+        return self.insert(
+            Tweet,
+            (
+                Tweet(
+                    user_id=user_ids[skewed_index(rng, n, options["skew"])],
+                    content=f"tweet {i}",
+                    created_at=self.timestamp(i, count),
+                )
+                for i in range(count)
+            ),
+        )
+
+    def create_likes(self, rng, user_ids, tweet_ids, options):
+        # 新しいツイートほどいいねされやすくする
+        n = len(tweet_ids)
+
+        def rows():
+            for user_id in user_ids:
+                for index in sample_skewed(rng, n, rng.randint(0, 2 * options["likes"]), options["skew"]):
+                    yield Like(user_id=user_id, tweet_id=tweet_ids[n - 1 - index])
+
+        return self.insert(Like, rows() if n else ())
+
+    def rebuild_timelines(self, user_ids):
+        # 投入中に他のユーザーが作られると主キーは連続しないため，投入した主キーで引く
+        rebuilt = array("q")
+        for start in range(0, len(user_ids), USER_BATCH_SIZE):
+            users = CustomUser.objects.filter(pk__in=user_ids[start : start + USER_BATCH_SIZE]).order_by("pk")
+            for user in users:
+                with transaction.atomic():
+                    timeline.rebuild(user)
+                rebuilt.append(user.pk)
+        return rebuilt
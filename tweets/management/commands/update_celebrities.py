@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from tweets import timeline
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "フォロワー数に合わせて有名ユーザー（ツイートをファンアウトしないユーザー）を更新します。"
+        "TIMELINE_DEMOTE_THRESHOLD を下回ったユーザーは，最近のツイートをフォロワーのタイムラインに書き込んで戻します。"
+    )
+
+    def handle(self, *args, **options):
+        promoted = timeline.promote_celebrities()
+        demoted = 0
+        candidates = CustomUser.objects.filter(
+            is_celebrity=True, follower_count__lt=settings.TIMELINE_DEMOTE_THRESHOLD
+        ).values_list("pk", flat=True)
+        for user_id in list(candidates):
+            demoted += timeline.demote(user_id)
+        self.stdout.write(self.style.SUCCESS(f"{promoted} 人を有名ユーザーにし，{demoted} 人を戻しました。"))
@@ -0,0 +1,71 @@
+# Generated by Django 4.1.13 on 2026-10-18 09:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+import tweets.models
+
+# trigram トークナイザは日本語のように空白で区切らない文章も 3 文字単位で索引付けする
+CREATE_SEARCH_TABLE = [
+    """
+    CREATE VIRTUAL TABLE tweets_tweet_fts USING fts5(
+        content, content='tweets_tweet', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER tweets_tweet_fts_insert AFTER INSERT ON tweets_tweet BEGIN
+        INSERT INTO tweets_tweet_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER tweets_tweet_fts_delete AFTER DELETE ON tweets_tweet BEGIN
+        INSERT INTO tweets_tweet_fts(tweets_tweet_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER tweets_tweet_fts_update AFTER UPDATE OF content ON tweets_tweet BEGIN
+        INSERT INTO tweets_tweet_fts(tweets_tweet_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO tweets_tweet_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    "INSERT INTO tweets_tweet_fts(tweets_tweet_fts) VALUES ('rebuild')",
+]
+
+DROP_SEARCH_TABLE = [
+    "DROP TRIGGER tweets_tweet_fts_update",
+    "DROP TRIGGER tweets_tweet_fts_delete",
+    "DROP TRIGGER tweets_tweet_fts_insert",
+    "DROP TABLE tweets_tweet_fts",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0007_query_shape_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TweetSearch",
+            fields=[
+                (
+                    "tweet",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="search",
+                        serialize=False,
+                        to="tweets.tweet",
+                    ),
+                ),
+                ("content", tweets.models.SearchField()),
+                ("rank", models.FloatField()),
+            ],
+            options={
+                "db_table": "tweets_tweet_fts",
+                "managed": False,
+            },
+        ),
+        migrations.RunSQL(CREATE_SEARCH_TABLE, DROP_SEARCH_TABLE),
+    ]
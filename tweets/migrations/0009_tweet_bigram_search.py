@@ -0,0 +1,77 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import tweets.models
+
+# トリガーの中では再帰 CTE を使えないため，文字の位置 1〜140（Tweet.content の max_length）を表に持っておく
+# 各ツイートの 2 文字ずつの部分文字列（末尾は 1 文字）を空白区切りにして unicode61 トークナイザで索引付けする
+BIGRAMS = "(SELECT group_concat(substr({0}.content, n, 2), ' ') FROM tweets_search_position WHERE n <= length({0}.content))"
+
+CREATE_BIGRAM_TABLE = [
+    "CREATE TABLE tweets_search_position (n INTEGER PRIMARY KEY)",
+    """
+    WITH RECURSIVE position(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM position WHERE n < 140)
+    INSERT INTO tweets_search_position SELECT n FROM position
+    """,
+    "CREATE VIRTUAL TABLE tweets_tweet_bigram USING fts5(bigrams, content='', tokenize='unicode61')",
+    f"""
+    CREATE TRIGGER tweets_tweet_bigram_insert AFTER INSERT ON tweets_tweet BEGIN
+        INSERT INTO tweets_tweet_bigram(rowid, bigrams) VALUES (new.id, {BIGRAMS.format("new")});
+    END
+    """,
+    f"""
+    CREATE TRIGGER tweets_tweet_bigram_delete AFTER DELETE ON tweets_tweet BEGIN
+        INSERT INTO tweets_tweet_bigram(tweets_tweet_bigram, rowid, bigrams)
+        VALUES ('delete', old.id, {BIGRAMS.format("old")});
+    END
+    """,
+    f"""
+    CREATE TRIGGER tweets_tweet_bigram_update AFTER UPDATE OF content ON tweets_tweet BEGIN
+        INSERT INTO tweets_tweet_bigram(tweets_tweet_bigram, rowid, bigrams)
+        VALUES ('delete', old.id, {BIGRAMS.format("old")});
+        INSERT INTO tweets_tweet_bigram(rowid, bigrams) VALUES (new.id, {BIGRAMS.format("new")});
+    END
+    """,
+    f"INSERT INTO tweets_tweet_bigram(rowid, bigrams) SELECT id, {BIGRAMS.format('tweets_tweet')} FROM tweets_tweet",
+]
+
+DROP_BIGRAM_TABLE = [
+    "DROP TRIGGER tweets_tweet_bigram_update",
+    "DROP TRIGGER tweets_tweet_bigram_delete",
+    "DROP TRIGGER tweets_tweet_bigram_insert",
+    "DROP TABLE tweets_tweet_bigram",
+    "DROP TABLE tweets_search_position",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0008_tweet_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TweetBigramSearch",
+            fields=[
+                (
+                    "tweet",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="bigram_search",
+                        serialize=False,
+                        to="tweets.tweet",
+                    ),
+                ),
+                ("bigrams", tweets.models.SearchField()),
+            ],
+            options={
+                "db_table": "tweets_tweet_bigram",
+                "managed": False,
+            },
+        ),
+        migrations.RunSQL(CREATE_BIGRAM_TABLE, DROP_BIGRAM_TABLE),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("tweets", "0009_tweet_bigram_search"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="timelineentry",
+            name="owner",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="timeline_entries",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
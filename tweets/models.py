@@ -3,14 +3,89 @@ from django.db import models
 
 
 class Tweet(models.Model):
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # user の検索は tweet_user_created_idx で行うため，外部キー単独のインデックスは作らない
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
     content = models.TextField(verbose_name="内容", max_length=140)
     created_at = models.DateTimeField(verbose_name="投稿日", auto_now_add=True)
+    # Like の件数の非正規化．更新は tweets.likes 経由で F() により行う
+    like_count = models.PositiveIntegerField(verbose_name="いいね数", default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="tweet_created_at_id_idx"),
+            models.Index(fields=["user", "-created_at", "-id"], name="tweet_user_created_idx"),
+        ]
 
 
 class Like(models.Model):
-    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="liked_tweet")
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="like_user")
+    # tweet の検索は unique_like，user の検索は like_user_tweet_idx で行う
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="liked_tweet", db_index=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="like_user", db_index=False
+    )
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=["tweet", "user"], name="unique_like")]
+        indexes = [models.Index(fields=["user", "tweet"], name="like_user_tweet_idx")]
+
+
+class TimelineEntry(models.Model):
+    # owner の検索は owner から始まる unique_timeline_entry と timeline_owner_created_idx で行う
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="timeline_entries", db_index=False
+    )
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="timeline_entries")
+    # ページングのキーに使うため，ツイートの投稿日を複製して持つ
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["owner", "tweet"], name="unique_timeline_entry")]
+        indexes = [models.Index(fields=["owner", "-created_at", "-tweet"], name="timeline_owner_created_idx")]
+
+
+class SearchField(models.TextField):
+    """FTS5 の仮想テーブルの列。content__match で MATCH 演算子を使える。"""
+
+
+@SearchField.register_lookup
+class Match(models.Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+class TweetSearch(models.Model):
+    """Tweet.content の全文検索用の FTS5 仮想テーブル（tweets_tweet を外部コンテンツとする）。
+
+    テーブルと同期用のトリガーはマイグレーション 0008 で作る。rank は FTS5 の bm25 スコアで，小さいほど関連度が高い。
+    """
+
+    tweet = models.OneToOneField(
+        Tweet, on_delete=models.DO_NOTHING, primary_key=True, db_column="rowid", related_name="search"
+    )
+    content = SearchField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = "tweets_tweet_fts"
+
+
+class TweetBigramSearch(models.Model):
+    """trigram で索引を引けない 1〜2 文字の語を検索する FTS5 の仮想テーブル（内容を持たない）。
+
+    bigrams はツイートの 2 文字ずつの部分文字列（末尾は 1 文字）を空白で区切ったもので，テーブルと同期用のトリガーは
+    マイグレーション 0009 で作る。2 文字の語は完全一致で，1 文字の語はその文字で始まる語の前方一致で探す。
+    """
+
+    tweet = models.OneToOneField(
+        Tweet, on_delete=models.DO_NOTHING, primary_key=True, db_column="rowid", related_name="bigram_search"
+    )
+    bigrams = SearchField()
+
+    class Meta:
+        managed = False
+        db_table = "tweets_tweet_bigram"
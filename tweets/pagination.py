@@ -0,0 +1,100 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    raw = json.dumps([created_at.isoformat(), pk], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        created_at, pk = json.loads(raw)
+        created_at = parse_datetime(created_at)
+    except (binascii.Error, TypeError, ValueError):
+        raise InvalidCursor(token)
+    if created_at is None or not isinstance(pk, int):
+        raise InvalidCursor(token)
+    return created_at, pk
+
+
+def before_cursor(created_at, pk, keys=("created_at", "id")):
+    # (created_at, id) < (cursor.created_at, cursor.id) の行だけを残す
+    # created_at <= cursor.created_at を単独の条件として加えると，SQLite がインデックスの範囲検索を使える
+    time_key, pk_key = keys
+    return Q(**{f"{time_key}__lte": created_at}) & (Q(**{f"{time_key}__lt": created_at}) | Q(**{f"{pk_key}__lt": pk}))
+
+
+def after_cursor(created_at, pk, keys=("created_at", "id")):
+    # before_cursor() の逆で，(created_at, id) > (cursor.created_at, cursor.id) の行だけを残す
+    time_key, pk_key = keys
+    return Q(**{f"{time_key}__gte": created_at}) & (Q(**{f"{time_key}__gt": created_at}) | Q(**{f"{pk_key}__gt": pk}))
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def build_page(rows, per_page, keys=("created_at", "id")):
+    """per_page + 1 件取得した行（モデルのインスタンスか values() の辞書）からページと次のカーソルを作る。"""
+    if len(rows) <= per_page:
+        return CursorPage(rows)
+    rows = rows[:per_page]
+    last = rows[-1]
+    if isinstance(last, dict):
+        return CursorPage(rows, encode_cursor(*(last[key] for key in keys)))
+    return CursorPage(rows, encode_cursor(*(getattr(last, key) for key in keys)))
+
+
+class CursorPaginator:
+    """(created_at, id) の降順に並べたクエリセットをキーセット方式でページングする。"""
+
+    def __init__(self, queryset, per_page, keys=("created_at", "id")):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keys = keys
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*(f"-{key}" for key in self.keys))
+        if cursor:
+            queryset = queryset.filter(before_cursor(*decode_cursor(cursor), keys=self.keys))
+        return build_page(list(queryset[: self.per_page + 1]), self.per_page, self.keys)
+
+
+class CursorPaginationMixin:
+    """ListView の page 番号によるページングを before カーソルによるページングに置き換える。"""
+
+    cursor_kwarg = "before"
+    paginator_class = CursorPaginator
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return self.paginator_class(queryset, per_page, **kwargs)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_paginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404("Invalid cursor.")
+        return (paginator, page, page.object_list, page.has_next())
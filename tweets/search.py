@@ -0,0 +1,57 @@
+import unicodedata
+
+from django.db.models import F
+
+from .models import Tweet
+
+# trigram トークナイザで索引を引ける語の最小の長さ。これより短い語は bigram の索引（TweetBigramSearch）で絞り込む
+MIN_TERM_LENGTH = 3
+
+
+def quote(term):
+    # 語をフレーズとして引用し，FTS5 の演算子や記号として解釈されないようにする
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def match_expression(terms):
+    # 空白区切りは AND
+    return " ".join(quote(term) for term in terms)
+
+
+def is_bigram_indexed(term):
+    # unicode61 トークナイザは文字・数字（L*, N*, Co）以外を区切りとして捨てるため，記号や絵文字を含む語は引けない
+    return all(unicodedata.category(char)[0] in "LN" or unicodedata.category(char) == "Co" for char in term)
+
+
+def bigram_match_expression(terms):
+    # 1 文字の語は，その文字で始まる bigram（末尾の 1 文字を含む）の前方一致で探す
+    return " ".join(quote(term) + ("*" if len(term) == 1 else "") for term in terms)
+
+
+def search_tweets(query):
+    """query を空白で区切った全ての語を含むツイートを返す。
+
+    3 文字以上の語があれば trigram の FTS5 で検索して関連度順に並べる。短い語だけのときは，bigram の FTS5 で
+    引ける語で絞り込んで新しい順に並べる。短い語は，どちらの場合も絞り込んだ行の部分一致で確かめる
+    （bigram の索引は記号を区切りとして捨て，発音区別符号も区別しないため，索引だけでは広く一致する）。
+    """
+    terms = query.split()
+    if not terms:
+        return Tweet.objects.none()
+    indexed_terms = [term for term in terms if len(term) >= MIN_TERM_LENGTH]
+    short_terms = [term for term in terms if len(term) < MIN_TERM_LENGTH]
+    queryset = Tweet.objects.select_related("user")
+    if indexed_terms:
+        queryset = (
+            queryset.filter(search__content__match=match_expression(indexed_terms))
+            .annotate(rank=F("search__rank"))
+            .order_by("rank", "-id")
+        )
+    else:
+        bigram_terms = [term for term in short_terms if is_bigram_indexed(term)]
+        if bigram_terms:
+            queryset = queryset.filter(bigram_search__bigrams__match=bigram_match_expression(bigram_terms))
+        queryset = queryset.order_by("-created_at", "-id")
+    for term in short_terms:
+        queryset = queryset.filter(content__icontains=term)
+    return queryset
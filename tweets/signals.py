@@ -0,0 +1,48 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mysite import caching
+
+from . import live, timeline
+from .models import Like, Tweet
+
+
+@receiver(post_save, sender=Tweet)
+def fan_out_tweet(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Tweet)
+def publish_new_tweet(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(partial(live.broker.publish_new_tweet, instance.user_id))
+
+
+@receiver(post_save, sender=Tweet)
+@receiver(post_delete, sender=Tweet)
+def bump_tweet_version(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    caching.bump_version(caching.TWEET, instance.pk)
+    caching.bump_version(caching.USER, instance.user_id)
+    caching.bump_version(caching.AUTHOR, instance.user_id)
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def bump_like_versions(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    caching.bump_version(caching.TWEET, instance.tweet_id)
+    caching.bump_version(caching.USER, instance.user_id)
+    # いいねの登録時はツイートが読み込み済みなので，投稿者を引くクエリを発行しない
+    if Like.tweet.is_cached(instance):
+        caching.bump_version(caching.AUTHOR, instance.tweet.user_id)
+    else:
+        caching.bump_versions(
+            caching.AUTHOR, Tweet.objects.filter(pk=instance.tweet_id).values_list("user_id", flat=True)
+        )
@@ -0,0 +1,98 @@
+"""いいね数の変化と新しいツイートを Server-Sent Events で配信する ASGI アプリケーション。
+
+Django 4.1 の StreamingHttpResponse は非同期のイテレータを扱えず，接続ごとにスレッドを占有してしまうため，
+mysite.asgi で STREAM_PATH へのリクエストだけをこのアプリケーションに振り分ける。
+
+GET /tweets/stream/?tweets=1,2,3 に接続すると，次のイベントを送る。
+- like_counts: 画面上のツイート（tweets で指定）のいいね数 {"ツイートの ID": いいね数}
+- new_tweets: フォローしているユーザーの新しいツイートの件数 {"count": 件数}
+"""
+
+import asyncio
+import json
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.http.cookie import parse_cookie
+
+from accounts.models import FriendShip
+
+from .live import Subscription, broker
+
+STREAM_PATH = "/tweets/stream/"
+# プロキシに接続を切られないよう，変化がなくてもこの秒数ごとにコメント行を送る
+KEEPALIVE_INTERVAL = 15
+MAX_TWEETS = 100
+
+
+def load_user(scope):
+    headers = dict(scope["headers"])
+    session_key = parse_cookie(headers.get(b"cookie", b"").decode("latin-1")).get(settings.SESSION_COOKIE_NAME)
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    return get_user(SimpleNamespace(session=session))
+
+
+def followee_ids(user):
+    return list(FriendShip.objects.filter(follower=user).values_list("followee_id", flat=True))
+
+
+def parse_tweet_ids(scope):
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    values = ",".join(query.get("tweets", [])).split(",")
+    return {int(value) for value in values if value.isdigit()}
+
+
+def format_events(changes):
+    if changes is None:
+        return b": keepalive\n\n"
+    events = []
+    if changes["like_counts"]:
+        events.append(("like_counts", changes["like_counts"]))
+    if changes["new_tweets"]:
+        events.append(("new_tweets", {"count": changes["new_tweets"]}))
+    return "".join(f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in events).encode()
+
+
+async def send_status(send, status, body):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def application(scope, receive, send):
+    if scope["method"] != "GET":
+        return await send_status(send, 405, b"Method Not Allowed")
+    user = await sync_to_async(load_user)(scope)
+    if not user.is_authenticated:
+        return await send_status(send, 401, b"Unauthorized")
+    tweet_ids = sorted(parse_tweet_ids(scope))[-MAX_TWEETS:]
+    subscription = Subscription(asyncio.get_running_loop(), await sync_to_async(followee_ids)(user), tweet_ids)
+
+    broker.subscribe(subscription)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+            }
+        )
+        while True:
+            changes = asyncio.ensure_future(subscription.get(KEEPALIVE_INTERVAL))
+            await asyncio.wait({changes, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                changes.cancel()
+                break
+            await send({"type": "http.response.body", "body": format_events(changes.result()), "more_body": True})
+    finally:
+        broker.unsubscribe(subscription)
+        disconnected.cancel()
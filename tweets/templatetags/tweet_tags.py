@@ -0,0 +1,28 @@
+from django import template
+from django.urls import reverse
+
+from mysite import caching
+
+register = template.Library()
+
+
+@register.simple_tag
+def user_version(user_id):
+    """ユーザーの mysite.caching のバージョンを返す。{% cache %} の vary_on に加えて，ユーザー名の変更などで作り直させる。"""
+    return caching.get_version(caching.USER, user_id)
+
+
+@register.inclusion_tag("tweets/like.html", takes_context=True)
+def like_button(context, tweet):
+    """いいねボタンを描画する。
+
+    ツイートの一覧では行ごとに描画されるため，分岐と URL の組み立てはここで済ませ，
+    数値もテンプレートでのローカライズを通らないよう文字列にして渡す。
+    """
+    is_liked = tweet.pk in context.get("liked_tweet_ids", ())
+    return {
+        "tweet_id": str(tweet.pk),
+        "url": reverse("tweets:unlike" if is_liked else "tweets:like", kwargs={"pk": tweet.pk}),
+        "label": "いいねを取り消す" if is_liked else "いいね",
+        "like_count": str(tweet.like_count),
+    }
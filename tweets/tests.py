@@ -1,8 +1,31 @@
+import asyncio
+import random
+import subprocess
+import sys
+from array import array
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.db.models.signals import post_init
+from django.template import Context, Template
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 
-from tweets.models import Like, Tweet
+from accounts import follows
+from accounts.models import FriendShip
+from mysite import caching
+from tweets import likes, live, stream, timeline
+from tweets.management.commands import seed_data
+from tweets.models import Like, TimelineEntry, Tweet
 
 CustomUser = get_user_model()
 
@@ -20,8 +43,181 @@ class TestHomeView(TestCase):
         self.assertTemplateUsed(response, "tweets/home.html")
 
         tweets = response.context["tweet_list"]
-        self.assertEqual(tweets.count(), Tweet.objects.all().count())
-        self.assertEqual(tweets.first().created_at, Tweet.objects.first().created_at)
+        self.assertEqual(len(tweets), Tweet.objects.all().count())
+        self.assertEqual(tweets[0].created_at, Tweet.objects.first().created_at)
+
+    def test_success_get_with_cursor(self):
+        for i in range(25):
+            Tweet.objects.create(user=self.user, content=f"tweet{i}")
+        response = self.client.get(reverse("tweets:home"))
+        first_page = response.context["tweet_list"]
+        self.assertEqual(len(first_page), 20)
+        self.assertTrue(response.context["page_obj"].has_next())
+
+        response = self.client.get(reverse("tweets:home"), {"before": response.context["page_obj"].next_cursor})
+        second_page = response.context["tweet_list"]
+        self.assertEqual(len(second_page), 6)
+        self.assertFalse(response.context["page_obj"].has_next())
+        self.assertEqual(
+            [tweet.pk for tweet in first_page + second_page],
+            list(Tweet.objects.order_by("-created_at", "-id").values_list("pk", flat=True)),
+        )
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(reverse("tweets:home"), {"before": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_liked_tweet_ids_only_for_visible_tweets(self):
+        other = CustomUser.objects.create_user(username="testuser02", password="v6EaZYBT")
+        hidden_tweet = Tweet.objects.create(user=other, content="hidden_tweet")
+        Like.objects.create(tweet=hidden_tweet, user=self.user)
+        Like.objects.create(tweet=self.tweet, user=self.user)
+
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(response.context["liked_tweet_ids"], {self.tweet.pk})
+        self.assertContains(response, reverse("tweets:unlike", kwargs={"pk": self.tweet.pk}), count=1)
+
+
+class TestHomeTimeline(TestCase):
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        self.user2 = CustomUser.objects.create_user(username="testuser02", password="v6EaZYBT")
+        self.user3 = CustomUser.objects.create_user(username="testuser03", password="z6HqkuAR")
+        self.client.login(username="testuser01", password="a4AXBLnb")
+        self.tweet2 = Tweet.objects.create(user=self.user2, content="tweet02")
+        self.tweet3 = Tweet.objects.create(user=self.user3, content="tweet03")
+
+    def get_home_tweets(self):
+        response = self.client.get(reverse("tweets:home"))
+        return response.context["tweet_list"]
+
+    def test_only_followees_tweets(self):
+        self.assertEqual(self.get_home_tweets(), [])
+
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        self.assertEqual(self.get_home_tweets(), [self.tweet2])
+
+    def test_fan_out_on_create(self):
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        tweet = Tweet.objects.create(user=self.user2, content="new_tweet")
+        self.assertEqual(self.get_home_tweets(), [tweet, self.tweet2])
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user2, tweet=tweet).exists())
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user3, tweet=tweet).exists())
+
+    def test_prune_on_unfollow(self):
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "testuser02"}))
+        self.assertEqual(self.get_home_tweets(), [])
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user1).exists())
+
+    def test_entries_removed_with_tweet(self):
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        self.tweet2.delete()
+        self.assertEqual(self.get_home_tweets(), [])
+
+    @override_settings(TIMELINE_FAN_OUT_THRESHOLD=1)
+    def test_celebrity_tweets_merged_on_read(self):
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser03"}))
+        tweet = Tweet.objects.create(user=self.user2, content="celebrity_tweet")
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user1, tweet=tweet).exists())
+        self.assertEqual(self.get_home_tweets(), [tweet, self.tweet3, self.tweet2])
+
+    @override_settings(TIMELINE_FAN_OUT_THRESHOLD=3, TIMELINE_DEMOTE_THRESHOLD=2)
+    def test_celebrity_tweets_backfilled_on_demotion(self):
+        user4 = CustomUser.objects.create_user(username="testuser04", password="k2PzVnqw")
+        follows.follow(self.user3, self.user2)
+        follows.follow(user4, self.user2)
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        tweet = Tweet.objects.create(user=self.user2, content="celebrity_tweet")
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user3, tweet=tweet).exists())
+
+        # 閾値を下回っても TIMELINE_DEMOTE_THRESHOLD までは有名ユーザーのまま
+        follows.unfollow(user4, self.user2)
+        call_command("update_celebrities", stdout=StringIO())
+        self.assertTrue(timeline.is_celebrity(self.user2.pk))
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user3, tweet=tweet).exists())
+
+        # フォロー解除のリクエストではフォロワーのタイムラインに書き込まない
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "testuser02"}))
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user3, tweet=tweet).exists())
+        call_command("update_celebrities", stdout=StringIO())
+        self.assertFalse(timeline.is_celebrity(self.user2.pk))
+        entries = TimelineEntry.objects.filter(owner=self.user3).values_list("tweet_id", flat=True)
+        self.assertCountEqual(entries, [tweet.pk, self.tweet2.pk, self.tweet3.pk])
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user1).exists())
+
+    @override_settings(TIMELINE_FAN_OUT_THRESHOLD=1, TIMELINE_DEMOTE_THRESHOLD=1)
+    def test_update_celebrities_promotes(self):
+        # フォロー数の修正などで閾値を超えたユーザーも有名ユーザーにする
+        FriendShip.objects.create(follower=self.user1, followee=self.user2)
+        follows.repair_follow_counts()
+        self.assertFalse(timeline.is_celebrity(self.user2.pk))
+        call_command("update_celebrities", stdout=StringIO())
+        self.assertTrue(timeline.is_celebrity(self.user2.pk))
+
+    @override_settings(TIMELINE_FAN_OUT_THRESHOLD=2)
+    def test_celebrity_tweets_paginated(self):
+        follows.follow(self.user3, self.user2)
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        for i in range(25):
+            Tweet.objects.create(user=self.user2 if i % 2 else self.user1, content=f"tweet{i}")
+        response = self.client.get(reverse("tweets:home"))
+        first_page = response.context["tweet_list"]
+        response = self.client.get(reverse("tweets:home"), {"before": response.context["page_obj"].next_cursor})
+        second_page = response.context["tweet_list"]
+        self.assertFalse(response.context["page_obj"].has_next())
+        self.assertEqual(
+            [tweet.pk for tweet in first_page + second_page],
+            list(
+                Tweet.objects.filter(user__in=[self.user1, self.user2])
+                .order_by("-created_at", "-id")
+                .values_list("pk", flat=True)
+            ),
+        )
+
+    def test_rebuild_timelines_command(self):
+        self.user1.following.add(self.user3)
+        TimelineEntry.objects.all().delete()
+        call_command("rebuild_timelines", stdout=StringIO())
+        self.assertEqual(self.get_home_tweets(), [self.tweet3])
+
+
+class TestTweetFragmentCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username="testuser", password="testpass01")
+        self.client.login(username="testuser", password="testpass01")
+        self.tweet = Tweet.objects.create(user=self.user, content="test_tweet")
+
+    def fragment_key(self):
+        return make_template_fragment_key("tweet", [self.tweet.pk, caching.get_version(caching.USER, self.user.pk)])
+
+    def test_fragment_cached(self):
+        self.client.get(reverse("tweets:home"))
+        self.assertIn("test_tweet", cache.get(self.fragment_key()))
+
+        Tweet.objects.filter(pk=self.tweet.pk).update(content="updated_tweet")
+        response = self.client.get(reverse("tweets:home"))
+        self.assertContains(response, "test_tweet")
+
+    def test_liked_state_not_cached(self):
+        self.client.get(reverse("tweets:home"))
+        Like.objects.create(tweet=self.tweet, user=self.user)
+        response = self.client.get(reverse("tweets:home"))
+        self.assertContains(response, reverse("tweets:unlike", kwargs={"pk": self.tweet.pk}))
+
+    def test_fragment_invalidated_on_delete(self):
+        self.client.get(reverse("tweets:home"))
+        self.client.post(reverse("tweets:delete", kwargs={"pk": self.tweet.pk}))
+        self.assertIsNone(cache.get(self.fragment_key()))
+
+    def test_fragment_invalidated_on_rename(self):
+        self.client.get(reverse("tweets:home"))
+        self.user.username = "renamed"
+        self.user.save()
+        response = self.client.get(reverse("tweets:home"))
+        self.assertNotContains(response, reverse("accounts:profile", kwargs={"username": "testuser"}))
 
 
 class TestTweetCreateView(TestCase):
@@ -74,6 +270,32 @@ class TestTweetDetailView(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context["tweet"], self.tweet)
         self.assertTemplateUsed(response, "tweets/detail.html")
+        self.assertEqual(response.context["liked_tweet_ids"], set())
+
+    def test_success_get_with_liked_tweet(self):
+        Like.objects.create(tweet=self.tweet, user=self.user)
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.context["liked_tweet_ids"], {self.tweet.pk})
+        self.assertContains(response, f'data-url="{reverse("tweets:unlike", kwargs={"pk": self.tweet.pk})}"')
+
+
+class TestLikeButtonTag(SimpleTestCase):
+    def test_render(self):
+        user = CustomUser(pk=1, username="testuser")
+        tweets = [Tweet(pk=pk, user=user, content="tweet", like_count=pk * 1000) for pk in (1, 2)]
+        template = Template("{% load tweet_tags %}{% for tweet in tweets %}{% like_button tweet %}{% endfor %}")
+        html = template.render(Context({"tweets": tweets, "liked_tweet_ids": {2}}))
+        self.assertInHTML(
+            f'<button id="tweet-1" onclick="changeLike(id)" data-url="{reverse("tweets:like", kwargs={"pk": 1})}">'
+            "いいね</button>",
+            html,
+        )
+        self.assertInHTML(
+            f'<button id="tweet-2" onclick="changeLike(id)" data-url="{reverse("tweets:unlike", kwargs={"pk": 2})}">'
+            "いいねを取り消す</button>",
+            html,
+        )
+        self.assertInHTML('<span class="count_2">2000</span>', html)
 
 
 class TestTweetDeleteView(TestCase):
@@ -115,6 +337,16 @@ class TestLikeView(TestCase):
         response = self.client.post(self.url)
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Like.objects.count(), 1)
+        self.assertEqual(response.json()["like_count"], 1)
+        self.data.refresh_from_db()
+        self.assertEqual(self.data.like_count, 1)
+
+    def test_success_post_twice(self):
+        self.client.post(self.url)
+        response = self.client.post(self.url)
+        self.assertEqual(response.json()["like_count"], 1)
+        self.data.refresh_from_db()
+        self.assertEqual(self.data.like_count, 1)
 
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:like", kwargs={"pk": "1000"}))
@@ -127,12 +359,25 @@ class TestLikeView(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Like.objects.count(), 1)
 
+    async def test_success_post_via_asgi(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user)
+        response = await client.post(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["like_count"], 1)
+        self.assertEqual(await Like.objects.filter(tweet=self.data, user=self.user).acount(), 1)
+
+    async def test_failure_post_without_login_via_asgi(self):
+        response = await AsyncClient().post(self.url)
+        self.assertRedirects(response, f"{reverse('accounts:login')}?next={self.url}", fetch_redirect_response=False)
+        self.assertEqual(await Like.objects.acount(), 0)
+
 
 class TestUnLikeView(TestCase):
     def setUp(self):
         self.user = CustomUser.objects.create_user(username="testuser01", password="testpass0000")
         self.client.login(username="testuser01", password="testpass0000")
-        self.data = Tweet.objects.create(user=self.user, content="testtweet01")
+        self.data = Tweet.objects.create(user=self.user, content="testtweet01", like_count=1)
         Like.objects.create(tweet=self.data, user=self.user)
         self.url = reverse("tweets:unlike", kwargs={"pk": self.data.pk})
 
@@ -140,6 +385,9 @@ class TestUnLikeView(TestCase):
         response = self.client.post(self.url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Like.objects.count(), 0)
+        self.assertEqual(response.json()["like_count"], 0)
+        self.data.refresh_from_db()
+        self.assertEqual(self.data.like_count, 0)
 
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:unlike", kwargs={"pk": "1000"}))
@@ -150,3 +398,512 @@ class TestUnLikeView(TestCase):
         Like.objects.filter(tweet=self.data, user=self.user).delete()
         response = self.client.post(self.url)
         self.assertEqual(response.status_code, 200)
+        self.data.refresh_from_db()
+        self.assertEqual(self.data.like_count, 1)
+
+
+class TestLikeBatchView(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="testuser01", password="testpass0000")
+        self.client.login(username="testuser01", password="testpass0000")
+        self.tweet1 = Tweet.objects.create(user=self.user, content="testtweet01")
+        self.tweet2 = Tweet.objects.create(user=self.user, content="testtweet02", like_count=1)
+        Like.objects.create(tweet=self.tweet2, user=self.user)
+        self.url = reverse("tweets:like_batch")
+
+    def post_operations(self, operations):
+        return self.client.post(self.url, {"operations": operations}, content_type="application/json")
+
+    def test_success_post(self):
+        response = self.post_operations(
+            [
+                {"tweet_id": self.tweet1.pk, "liked": True},
+                {"tweet_id": self.tweet2.pk, "liked": False},
+                {"tweet_id": 1000, "liked": True},
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual(
+            response.json()["tweets"],
+            [
+                {"tweet_id": self.tweet1.pk, "like_count": 1, "is_liked": True},
+                {"tweet_id": self.tweet2.pk, "like_count": 0, "is_liked": False},
+            ],
+        )
+        self.assertEqual(response.json()["not_found"], [1000])
+        self.assertQuerysetEqual(Like.objects.values_list("tweet", flat=True), [self.tweet1.pk])
+
+    def test_success_post_is_idempotent(self):
+        operations = [{"tweet_id": self.tweet1.pk, "liked": True}, {"tweet_id": self.tweet2.pk, "liked": True}]
+        self.post_operations(operations)
+        response = self.post_operations(operations)
+        self.assertCountEqual(
+            [(tweet["tweet_id"], tweet["like_count"]) for tweet in response.json()["tweets"]],
+            [(self.tweet1.pk, 1), (self.tweet2.pk, 1)],
+        )
+        self.assertEqual(Like.objects.count(), 2)
+
+    def test_success_post_last_operation_wins(self):
+        response = self.post_operations(
+            [{"tweet_id": self.tweet1.pk, "liked": True}, {"tweet_id": self.tweet1.pk, "liked": False}]
+        )
+        self.assertEqual(response.json()["tweets"], [{"tweet_id": self.tweet1.pk, "like_count": 0, "is_liked": False}])
+        self.assertFalse(Like.objects.filter(tweet=self.tweet1).exists())
+
+    def test_failure_post_with_invalid_operations(self):
+        for body in ["not json", '{"operations": [{"tweet_id": "1", "liked": true}]}', '{"operations": {}}', "[]"]:
+            response = self.client.post(self.url, body, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Like.objects.count(), 1)
+
+    @override_settings(LIKE_BATCH_MAX_OPERATIONS=1)
+    def test_failure_post_with_too_many_operations(self):
+        response = self.post_operations(
+            [{"tweet_id": self.tweet1.pk, "liked": True}, {"tweet_id": self.tweet2.pk, "liked": False}]
+        )
+        self.assertEqual(response.status_code, 400)
+        # 同じツイートへの操作も重複を除く前に数える
+        response = self.post_operations([{"tweet_id": self.tweet1.pk, "liked": True}] * 2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def run_concurrently(self, statement):
+        """いいね済みのツイートを読み込んだ直後に，別のリクエストの書き込みとして statement を 1 回だけ実行する。"""
+        pending = [statement]
+
+        def execute(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if pending and sql.startswith('SELECT "tweets_like"."tweet_id"'):
+                with context["connection"].cursor() as cursor:
+                    cursor.execute(*pending.pop())
+            return result
+
+        return connection.execute_wrapper(execute)
+
+    def test_concurrent_like_is_not_counted(self):
+        statement = (
+            'INSERT INTO "tweets_like" ("tweet_id", "user_id") VALUES (%s, %s)',
+            [self.tweet1.pk, self.user.pk],
+        )
+        with self.run_concurrently(statement):
+            like_counts = likes.apply_batch(self.user.pk, {self.tweet1.pk: True})
+        # 並行したいいねの分は like_count に含めない（もう一方のリクエストが数える）
+        self.assertEqual(like_counts, {self.tweet1.pk: 0})
+        self.assertEqual(Like.objects.filter(tweet=self.tweet1).count(), 1)
+
+    def test_concurrent_unlike_is_not_counted(self):
+        statement = ('DELETE FROM "tweets_like" WHERE "tweet_id" = %s', [self.tweet2.pk])
+        with self.run_concurrently(statement):
+            like_counts = likes.apply_batch(self.user.pk, {self.tweet2.pk: False})
+        self.assertEqual(like_counts, {self.tweet2.pk: 1})
+        self.assertFalse(Like.objects.exists())
+
+
+@override_settings(LIKE_WRITE_BEHIND=True, LIKE_BUFFER_FLUSH_INTERVAL=None)
+class TestLikeWriteBehind(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="testuser01", password="testpass0000")
+        self.client.login(username="testuser01", password="testpass0000")
+        self.tweet = Tweet.objects.create(user=self.user, content="testtweet01")
+        self.addCleanup(likes.pending_likes.flush, lambda user_id, operations: None)
+
+    def test_like_is_buffered(self):
+        response = self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.json()["like_count"], 1)
+        self.assertFalse(Like.objects.exists())
+
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.context["liked_tweet_ids"], {self.tweet.pk})
+        self.assertEqual(response.context["tweet"].like_count, 1)
+
+        self.assertEqual(likes.flush_pending_likes(), 1)
+        self.assertTrue(Like.objects.filter(tweet=self.tweet, user=self.user).exists())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.context["tweet"].like_count, 1)
+
+    def test_like_then_unlike_cancels(self):
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        response = self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.json()["like_count"], 0)
+
+        likes.flush_pending_likes()
+        self.assertFalse(Like.objects.exists())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
+
+    @override_settings(LIKE_BUFFER_MAX_SIZE=1)
+    def test_flush_when_buffer_is_full(self):
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        self.assertTrue(Like.objects.filter(tweet=self.tweet, user=self.user).exists())
+
+    def test_failed_flush_is_retried(self):
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+
+        def fail(user_id, operations):
+            raise DatabaseError
+
+        with self.assertRaises(DatabaseError):
+            likes.pending_likes.flush(fail)
+        self.assertEqual(len(likes.pending_likes), 1)
+        self.assertEqual(likes.flush_pending_likes(), 1)
+        self.assertTrue(Like.objects.exists())
+
+    def test_partially_failed_flush(self):
+        user2 = CustomUser.objects.create_user(username="testuser02", password="testpass0000")
+        likes.like(self.tweet, self.user)
+        likes.like(self.tweet, user2)
+        deltas = []
+
+        def apply(user_id, operations):
+            # 先に書き込んだユーザーのいいねは，データベースのいいね数と二重に数えない
+            deltas.append(likes.pending_likes.like_count_deltas([self.tweet.pk])[self.tweet.pk])
+            if user_id == user2.pk:
+                raise DatabaseError
+            return likes.apply_batch(user_id, operations)
+
+        with self.assertRaises(DatabaseError):
+            likes.pending_likes.flush(apply)
+        self.assertEqual(deltas, [2, 1])
+        self.assertEqual(list(Like.objects.values_list("user", flat=True)), [self.user.pk])
+        self.tweet.refresh_from_db()
+        pending = likes.pending_likes.like_count_deltas([self.tweet.pk])[self.tweet.pk]
+        self.assertEqual(self.tweet.like_count + pending, 2)
+
+        # 戻された操作だけが書き込まれる
+        self.assertEqual(likes.flush_pending_likes(), 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 2)
+
+
+class TestReconcileLikeCountsCommand(TestCase):
+    def test_success(self):
+        user1 = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        user2 = CustomUser.objects.create_user(username="testuser02", password="v6EaZYBT")
+        tweet1 = Tweet.objects.create(user=user1, content="tweet01", like_count=5)
+        tweet2 = Tweet.objects.create(user=user1, content="tweet02")
+        Like.objects.create(tweet=tweet2, user=user1)
+        Like.objects.create(tweet=tweet2, user=user2)
+
+        out = StringIO()
+        call_command("reconcile_like_counts", batch_size=1, stdout=out)
+        self.assertIn("2 件", out.getvalue())
+        tweet1.refresh_from_db()
+        tweet2.refresh_from_db()
+        self.assertEqual(tweet1.like_count, 0)
+        self.assertEqual(tweet2.like_count, 2)
+
+
+class TestBenchInteractionsCommand(SimpleTestCase):
+    def test_success(self):
+        # 計測用のテストデータベースを作り直すため，別のプロセスで実行する
+        result = subprocess.run(
+            [sys.executable, "manage.py", "bench_interactions", "--users", "2", "--requests", "4", "--threads", "2"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertRegex(result.stdout, r"wsgi .* errors=0")
+        self.assertRegex(result.stdout, r"asgi .* errors=0")
+
+
+class TestBenchRenderCommand(SimpleTestCase):
+    def test_success(self):
+        out = StringIO()
+        cache.set("session", "kept")
+        call_command("bench_render", tweets=3, iterations=2, stdout=out)
+        for profile in settings.TEMPLATE_PROFILES:
+            self.assertRegex(out.getvalue(), rf"{profile} +first=.*mean=")
+        # プロジェクトのキャッシュは消さない
+        self.assertEqual(cache.get("session"), "kept")
+
+
+class TestSearchView(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        self.client.force_login(self.user)
+        self.url = reverse("tweets:search")
+
+    def search(self, query, **params):
+        response = self.client.get(self.url, {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def contents(self, response):
+        return [tweet.content for tweet in response.context["tweet_list"]]
+
+    def test_japanese_text(self):
+        Tweet.objects.create(user=self.user, content="今日はいい天気ですね")
+        Tweet.objects.create(user=self.user, content="明日は雨らしい")
+        response = self.search("いい天気")
+        self.assertEqual(self.contents(response), ["今日はいい天気ですね"])
+        self.assertContains(response, "今日はいい天気ですね")
+
+    def test_ranked_by_relevance(self):
+        Tweet.objects.create(user=self.user, content="天気予報を見てから出かける。天気は晴れ，気温は高め")
+        Tweet.objects.create(user=self.user, content="天気予報")
+        self.assertEqual(
+            self.contents(self.search("天気予報")), ["天気予報", "天気予報を見てから出かける。天気は晴れ，気温は高め"]
+        )
+
+    def test_all_terms_must_match(self):
+        Tweet.objects.create(user=self.user, content="東京は晴れ")
+        Tweet.objects.create(user=self.user, content="東京は雨")
+        self.assertEqual(self.contents(self.search("東京は 雨")), ["東京は雨"])
+        self.assertEqual(self.contents(self.search("雨")), ["東京は雨"])
+
+    def test_short_terms(self):
+        # 1〜2 文字の語は bigram の索引で探す。語の位置が末尾でも見つかり，英字は大文字と小文字を区別しない
+        Tweet.objects.create(user=self.user, content="雨のち晴れ")
+        Tweet.objects.create(user=self.user, content="明日の天気")
+        Tweet.objects.create(user=self.user, content="OK, see you")
+        self.assertEqual(self.contents(self.search("天気")), ["明日の天気"])
+        self.assertEqual(self.contents(self.search("気")), ["明日の天気"])
+        self.assertEqual(self.contents(self.search("晴")), ["雨のち晴れ"])
+        self.assertEqual(self.contents(self.search("の")), ["明日の天気", "雨のち晴れ"])
+        self.assertEqual(self.contents(self.search("の 雨")), ["雨のち晴れ"])
+        self.assertEqual(self.contents(self.search("ok")), ["OK, see you"])
+        self.assertEqual(self.contents(self.search("天")), ["明日の天気"])
+
+    def test_short_terms_with_symbols(self):
+        # bigram の索引が捨てる記号や絵文字を含む語も部分一致で見つけ，記号を除いた語では一致させない
+        Tweet.objects.create(user=self.user, content="#django です")
+        Tweet.objects.create(user=self.user, content="C# 入門")
+        Tweet.objects.create(user=self.user, content="C 言語")
+        Tweet.objects.create(user=self.user, content="乾杯🎉")
+        Tweet.objects.create(user=self.user, content="café")
+        self.assertEqual(self.contents(self.search("#")), ["C# 入門", "#django です"])
+        self.assertEqual(self.contents(self.search("C#")), ["C# 入門"])
+        self.assertEqual(self.contents(self.search("🎉")), ["乾杯🎉"])
+        self.assertEqual(self.contents(self.search("!?")), [])
+        self.assertEqual(self.contents(self.search("# で")), ["#django です"])
+        # 索引は発音区別符号を区別しない
+        self.assertEqual(self.contents(self.search("fe")), [])
+        self.assertEqual(self.contents(self.search("fé")), ["café"])
+
+    def test_index_follows_tweet_changes(self):
+        tweet = Tweet.objects.create(user=self.user, content="search me")
+        tweet.content = "changed"
+        tweet.save()
+        self.assertEqual(self.contents(self.search("search")), [])
+        self.assertEqual(self.contents(self.search("se")), [])
+        self.assertEqual(self.contents(self.search("changed")), ["changed"])
+        self.assertEqual(self.contents(self.search("ch")), ["changed"])
+        tweet.delete()
+        self.assertEqual(self.contents(self.search("changed")), [])
+        self.assertEqual(self.contents(self.search("ch")), [])
+
+    def test_query_syntax_is_escaped(self):
+        Tweet.objects.create(user=self.user, content='say "hello" OR (bye)')
+        self.assertEqual(self.contents(self.search('"hello" OR (bye)')), ['say "hello" OR (bye)'])
+        self.assertEqual(self.contents(self.search("")), [])
+
+    def test_pagination(self):
+        Tweet.objects.bulk_create(Tweet(user=self.user, content=f"paginated {i}") for i in range(21))
+        response = self.search("paginated")
+        self.assertEqual(len(response.context["tweet_list"]), 20)
+        self.assertContains(response, "?q=paginated&page=2")
+        self.assertEqual(len(self.search("paginated", page=2).context["tweet_list"]), 1)
+
+
+class TestLiveBroker(SimpleTestCase):
+    def get_changes(self, publish, timeout=1):
+        async def run():
+            subscription = live.Subscription(asyncio.get_running_loop(), [1], [10], coalesce_interval=0.01)
+            broker = live.Broker()
+            broker.subscribe(subscription)
+            publish(broker)
+            return await subscription.get(timeout)
+
+        return asyncio.run(run())
+
+    def test_coalesces_bursts(self):
+        def publish(broker):
+            broker.publish_like_counts({10: 1})
+            broker.publish_like_counts({10: 2, 11: 5})
+            broker.publish_new_tweet(1)
+            broker.publish_new_tweet(1)
+            broker.publish_new_tweet(2)
+
+        self.assertEqual(self.get_changes(publish), {"like_counts": {10: 2}, "new_tweets": 2})
+
+    def test_timeout(self):
+        self.assertIsNone(self.get_changes(lambda broker: broker.publish_like_counts({11: 1}), timeout=0.01))
+
+
+@override_settings(LIVE_COALESCE_INTERVAL=0)
+class TestStream(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        self.other = CustomUser.objects.create_user(username="testuser02", password="v6EaZYBT")
+        follows.follow(self.user, self.other)
+        self.tweet = Tweet.objects.create(user=self.other, content="tweet01")
+        self.client.force_login(self.user)
+
+    def scope(self, cookie):
+        return {
+            "type": "http",
+            "method": "GET",
+            "path": stream.STREAM_PATH,
+            "query_string": f"tweets={self.tweet.pk}".encode(),
+            "headers": [(b"cookie", cookie.encode())],
+        }
+
+    async def test_pushes_like_counts_and_new_tweets(self):
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        receive, sent = asyncio.Queue(), asyncio.Queue()
+        task = asyncio.ensure_future(stream.application(self.scope(cookie), receive.get, sent.put))
+        self.assertEqual((await sent.get())["status"], 200)
+
+        await likes.alike(self.tweet, self.other)
+        body = (await asyncio.wait_for(sent.get(), 5))["body"].decode()
+        self.assertEqual(body, f'event: like_counts\ndata: {{"{self.tweet.pk}": 1}}\n\n')
+
+        await sync_to_async(Tweet.objects.create)(user=self.other, content="tweet02")
+        body = (await asyncio.wait_for(sent.get(), 5))["body"].decode()
+        self.assertEqual(body, 'event: new_tweets\ndata: {"count": 1}\n\n')
+
+        await receive.put({"type": "http.disconnect"})
+        await asyncio.wait_for(task, 5)
+
+    async def test_requires_login(self):
+        sent = asyncio.Queue()
+        await stream.application(self.scope(""), asyncio.Queue().get, sent.put)
+        self.assertEqual((await sent.get())["status"], 401)
+
+
+class TestTweetApi(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="testuser01", password="a4AXBLnb")
+        self.other = CustomUser.objects.create_user(username="testuser02", password="v6EaZYBT")
+        follows.follow(self.user, self.other)
+        self.tweet1 = Tweet.objects.create(user=self.user, content="tweet01")
+        self.tweet2 = Tweet.objects.create(user=self.other, content="tweet02")
+        likes.like(self.tweet2, self.user)
+        self.client.force_login(self.user)
+
+    def get_json(self, url, **params):
+        instances = []
+
+        def count_instance(sender, instance, **kwargs):
+            instances.append(instance)
+
+        post_init.connect(count_instance, sender=Tweet)
+        try:
+            response = self.client.get(url, params)
+        finally:
+            post_init.disconnect(count_instance, sender=Tweet)
+        # values() から直接 JSON にするので，Tweet のインスタンスは作らない
+        self.assertEqual(instances, [])
+        return response
+
+    def test_home(self):
+        data = self.get_json(reverse("tweets:api_home")).json()
+        self.assertEqual(
+            data["tweets"][0],
+            {
+                "id": self.tweet2.pk,
+                "user_id": self.other.pk,
+                "content": "tweet02",
+                "created_at": DjangoJSONEncoder().default(self.tweet2.created_at),
+                "like_count": 1,
+                "liked": True,
+            },
+        )
+        self.assertEqual([tweet["id"] for tweet in data["tweets"]], [self.tweet2.pk, self.tweet1.pk])
+        self.assertEqual(
+            data["users"],
+            {str(self.user.pk): {"username": "testuser01"}, str(self.other.pk): {"username": "testuser02"}},
+        )
+        self.assertIsNone(data["next"])
+
+    def test_field_selection(self):
+        data = self.get_json(reverse("tweets:api_home"), fields="id,content").json()
+        self.assertEqual(
+            data["tweets"],
+            [{"id": self.tweet2.pk, "content": "tweet02"}, {"id": self.tweet1.pk, "content": "tweet01"}],
+        )
+        self.assertNotIn("users", data)
+        self.assertEqual(self.get_json(reverse("tweets:api_home"), fields="id,password").status_code, 400)
+
+    def test_pagination(self):
+        Tweet.objects.bulk_create(Tweet(user=self.user, content=f"bulk {i}") for i in range(20))
+        url = reverse("tweets:api_user_tweets", kwargs={"username": "testuser01"})
+        data = self.get_json(url, fields="id").json()
+        self.assertEqual(len(data["tweets"]), 20)
+        data = self.get_json(url, fields="id", before=data["next"]).json()
+        self.assertEqual(data["tweets"], [{"id": self.tweet1.pk}])
+        self.assertIsNone(data["next"])
+        self.assertEqual(self.get_json(url, before="invalid").status_code, 404)
+        url = reverse("tweets:api_user_tweets", kwargs={"username": "notexists"})
+        self.assertEqual(self.get_json(url).status_code, 404)
+
+    def test_detail(self):
+        url = reverse("tweets:api_detail", kwargs={"pk": self.tweet2.pk})
+        data = self.get_json(url, fields="content,liked").json()
+        self.assertEqual(data, {"tweet": {"content": "tweet02", "liked": True}})
+        self.assertEqual(self.get_json(reverse("tweets:api_detail", kwargs={"pk": 1000})).status_code, 404)
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("tweets:api_home")).status_code, 403)
+
+
+class TestSeedDataCommand(TestCase):
+    def seed(self, prefix, **options):
+        options = {"users": 30, "follows": 4, "tweets": 200, "likes": 5, "seed": 1, **options}
+        call_command("seed_data", prefix=prefix, stdout=StringIO(), **options)
+        users = CustomUser.objects.filter(username__startswith=prefix)
+        return {user.pk: int(user.username[len(prefix) :]) for user in users}
+
+    def graph(self, indexes):
+        friendships = FriendShip.objects.filter(follower__in=indexes).values_list("follower_id", "followee_id")
+        return sorted((indexes[follower_id], indexes[followee_id]) for follower_id, followee_id in friendships)
+
+    def test_seed(self):
+        indexes = self.seed("seed")
+        self.assertEqual(len(indexes), 30)
+        self.assertFalse(FriendShip.objects.filter(follower=F("followee")).exists())
+        # 件数の非正規化とタイムラインは投入後に揃えられている
+        self.assertEqual(follows.repair_follow_counts(), 0)
+        self.assertEqual(likes.reconcile_like_counts(), 0)
+        self.assertTrue(TimelineEntry.objects.exists())
+        # フォローは添字の小さいユーザーに偏る
+        follower_counts = dict(CustomUser.objects.values_list("pk", "follower_count"))
+        by_index = sorted((index, follower_counts[pk]) for pk, index in indexes.items())
+        self.assertGreater(sum(count for _, count in by_index[:5]), sum(count for _, count in by_index[-5:]))
+        # 投稿日は主キーの順に並ぶ
+        created_at = list(Tweet.objects.order_by("pk").values_list("created_at", flat=True))
+        self.assertEqual(created_at, sorted(created_at))
+
+    def test_deterministic(self):
+        graph = self.graph(self.seed("first", skip_timelines=True))
+        self.assertEqual(self.graph(self.seed("second", skip_timelines=True)), graph)
+        self.assertNotEqual(self.graph(self.seed("third", seed=2, skip_timelines=True)), graph)
+
+    def test_existing_prefix(self):
+        CustomUser.objects.create_user(username="seed0", password="a4AXBLnb")
+        with self.assertRaisesMessage(CommandError, "seed0 は既に存在します"):
+            call_command("seed_data", users=2, follows=0, stdout=StringIO())
+
+    def test_too_many_samples(self):
+        # 選べる数を超えるフォロー数・いいね数は，黙って減らさずにエラーにする
+        with self.assertRaisesMessage(CommandError, "--follows は 2 以下"):
+            call_command("seed_data", users=10, follows=3, stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, "--likes は 5 以下"):
+            call_command("seed_data", users=10, follows=2, tweets=20, likes=6, stdout=StringIO())
+        self.assertFalse(CustomUser.objects.exists())
+        with self.assertRaises(ValueError):
+            seed_data.sample_skewed(random.Random(0), 10, 6, 3.0)
+
+    def test_rebuild_timelines(self):
+        # 主キーが連続していなくても，投入したユーザーのタイムラインだけを作り直す
+        users = [CustomUser.objects.create_user(username=f"testuser0{i}", password="a4AXBLnb") for i in range(3)]
+        Tweet.objects.bulk_create(Tweet(user=user, content="tweet") for user in users)
+        command = seed_data.Command(stdout=StringIO())
+        rebuilt = command.rebuild_timelines(array("q", [users[0].pk, users[2].pk]))
+        self.assertEqual(list(rebuilt), [users[0].pk, users[2].pk])
+        self.assertEqual(set(TimelineEntry.objects.values_list("owner_id", flat=True)), {users[0].pk, users[2].pk})
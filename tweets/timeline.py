@@ -0,0 +1,188 @@
+import heapq
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from accounts.models import FriendShip
+
+from .models import TimelineEntry, Tweet
+from .pagination import before_cursor, build_page, decode_cursor
+
+CustomUser = get_user_model()
+
+FAN_OUT_BATCH_SIZE = 1000
+
+
+def is_celebrity(user_id):
+    """有名ユーザー（CustomUser.is_celebrity）のツイートはファンアウトせず，読み込み時にマージする。"""
+    return CustomUser.objects.filter(pk=user_id, is_celebrity=True).exists()
+
+
+def celebrity_followee_ids(user):
+    friendships = FriendShip.objects.filter(follower=user, followee__is_celebrity=True)
+    return list(friendships.values_list("followee_id", flat=True))
+
+
+def _insert_entries(owner_ids, tweet):
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=owner_id, tweet=tweet, created_at=tweet.created_at) for owner_id in owner_ids],
+        ignore_conflicts=True,
+    )
+
+
+def _iter_follower_batches(user_id):
+    follower_ids = (
+        FriendShip.objects.filter(followee_id=user_id)
+        .values_list("follower_id", flat=True)
+        .iterator(chunk_size=FAN_OUT_BATCH_SIZE)
+    )
+    batch = []
+    for follower_id in follower_ids:
+        batch.append(follower_id)
+        if len(batch) >= FAN_OUT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def fan_out(tweet):
+    """投稿されたツイートを投稿者本人とフォロワー全員のタイムラインに書き込む。"""
+    _insert_entries([tweet.user_id], tweet)
+    if is_celebrity(tweet.user_id):
+        return
+    for batch in _iter_follower_batches(tweet.user_id):
+        _insert_entries(batch, tweet)
+
+
+def backfill(follower, followee):
+    """フォローした相手の最近のツイートをフォロワーのタイムラインに追加する。"""
+    if is_celebrity(followee.pk):
+        return
+    tweets = Tweet.objects.filter(user=followee).order_by("-created_at", "-id")[: settings.TIMELINE_BACKFILL_SIZE]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner=follower, tweet=tweet, created_at=tweet.created_at) for tweet in tweets],
+        ignore_conflicts=True,
+    )
+
+
+def promote_celebrities():
+    """フォロワー数が TIMELINE_FAN_OUT_THRESHOLD 以上のユーザーを有名ユーザーにし，その人数を返す。"""
+    return CustomUser.objects.filter(
+        is_celebrity=False, follower_count__gte=settings.TIMELINE_FAN_OUT_THRESHOLD
+    ).update(is_celebrity=True)
+
+
+def demote(user_id):
+    """フォロワー数が TIMELINE_DEMOTE_THRESHOLD を下回った有名ユーザーをファンアウトに戻す。戻した場合は True を返す。
+
+    有名ユーザーだった間のツイートはファンアウトされていないため，最近のツイートをフォロワー全員のタイムラインに
+    書き込む。フォロワーが多いので，書き込みはフォロワーのバッチごとのトランザクションに分ける。
+    先にファンアウトに戻すので，書き込み終わるまでの間は，まだのフォロワーのタイムラインにそれまでのツイートが出ない。
+    """
+    demoted = CustomUser.objects.filter(
+        pk=user_id, is_celebrity=True, follower_count__lt=settings.TIMELINE_DEMOTE_THRESHOLD
+    ).update(is_celebrity=False)
+    if not demoted:
+        return False
+    # ここから後のツイートは fan_out() で書き込まれる
+    tweets = list(
+        Tweet.objects.filter(user_id=user_id)
+        .order_by("-created_at", "-id")
+        .values_list("pk", "created_at")[: settings.TIMELINE_BACKFILL_SIZE]
+    )
+    for batch in _iter_follower_batches(user_id):
+        with transaction.atomic():
+            TimelineEntry.objects.bulk_create(
+                [
+                    TimelineEntry(owner_id=owner_id, tweet_id=pk, created_at=created_at)
+                    for owner_id in batch
+                    for pk, created_at in tweets
+                ],
+                batch_size=FAN_OUT_BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+    return True
+
+
+def prune(follower, followee):
+    """フォロー解除した相手のツイートをフォロワーのタイムラインから取り除く。"""
+    TimelineEntry.objects.filter(owner=follower, tweet__user=followee).delete()
+
+
+def rebuild(user):
+    """本人とフォロー中のユーザーのツイートからタイムラインを作り直す。"""
+    TimelineEntry.objects.filter(owner=user).delete()
+    celebrity_ids = celebrity_followee_ids(user)
+    followee_ids = (
+        FriendShip.objects.filter(follower=user)
+        .exclude(followee_id__in=celebrity_ids)
+        .values_list("followee_id", flat=True)
+    )
+    tweets = (
+        Tweet.objects.filter(user_id__in=[user.pk, *followee_ids])
+        .order_by("-created_at", "-id")
+        .values_list("pk", "created_at")[: settings.TIMELINE_BACKFILL_SIZE]
+    )
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner=user, tweet_id=pk, created_at=created_at) for pk, created_at in tweets]
+    )
+
+
+class TimelinePaginator:
+    """タイムラインのエントリーと，フォロー中の有名ユーザーの最近のツイートをマージしてページングする。"""
+
+    def __init__(self, queryset, per_page, celebrity_ids=()):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.celebrity_ids = celebrity_ids
+
+    def page(self, cursor=None):
+        limit = self.per_page + 1
+        before = decode_cursor(cursor) if cursor else None
+
+        entries = self.queryset.select_related("tweet__user").order_by("-created_at", "-tweet_id")
+        if before:
+            entries = entries.filter(before_cursor(*before, keys=("created_at", "tweet_id")))
+        sources = [[entry.tweet for entry in entries[:limit]]]
+        if self.celebrity_ids:
+            sources.append(list(self._celebrity_tweets(before).select_related("user")[:limit]))
+        rows = self._merge(sources, limit, key=lambda tweet: (tweet.created_at, tweet.pk))
+        return build_page(rows, self.per_page)
+
+    def page_values(self, cursor=None, fields=("id", "created_at")):
+        """page() と同じ順序のツイートを，モデルのインスタンスを作らずに fields の辞書として返す。"""
+        limit = self.per_page + 1
+        before = decode_cursor(cursor) if cursor else None
+
+        entries = self.queryset.order_by("-created_at", "-tweet_id")
+        if before:
+            entries = entries.filter(before_cursor(*before, keys=("created_at", "tweet_id")))
+        sources = [list(entries.values_list("tweet_id", "created_at")[:limit])]
+        if self.celebrity_ids:
+            sources.append(list(self._celebrity_tweets(before).values_list("id", "created_at")[:limit]))
+        keys = self._merge(sources, limit, key=lambda key: (key[1], key[0]))
+
+        tweet_ids = [tweet_id for tweet_id, _ in keys]
+        tweets = Tweet.objects.filter(pk__in=tweet_ids).values("id", "created_at", *fields)
+        tweets = {tweet["id"]: tweet for tweet in tweets}
+        return build_page([tweets[tweet_id] for tweet_id in tweet_ids if tweet_id in tweets], self.per_page)
+
+    def _celebrity_tweets(self, before):
+        tweets = Tweet.objects.filter(user_id__in=self.celebrity_ids).order_by("-created_at", "-id")
+        if before:
+            tweets = tweets.filter(before_cursor(*before))
+        return tweets
+
+    def _merge(self, sources, limit, key):
+        # 閾値をまたいだユーザーのツイートは両方に含まれうるので重複を除く
+        rows, seen = [], set()
+        for row in heapq.merge(*sources, key=key, reverse=True):
+            if key(row) in seen:
+                continue
+            seen.add(key(row))
+            rows.append(row)
+            if len(rows) == limit:
+                break
+        return rows
@@ -1,13 +1,18 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 app_name = "tweets"
 urlpatterns = [
     path("home/", views.HomeView.as_view(), name="home"),
     path("create/", views.TweetCreateView.as_view(), name="create"),
+    path("search/", views.SearchView.as_view(), name="search"),
     path("<int:pk>/", views.TweetDetailView.as_view(), name="detail"),
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
     path("<int:pk>/like/", views.LikeView.as_view(), name="like"),
     path("<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
+    path("likes/batch/", views.LikeBatchView.as_view(), name="like_batch"),
+    path("api/home/", api.HomeTimelineApiView.as_view(), name="api_home"),
+    path("api/users/<str:username>/", api.UserTweetsApiView.as_view(), name="api_user_tweets"),
+    path("api/<int:pk>/", api.TweetDetailApiView.as_view(), name="api_detail"),
 ]
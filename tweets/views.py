@@ -1,24 +1,69 @@
+import json
+
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import Http404, JsonResponse
 from django.urls import reverse, reverse_lazy
 from django.views import View
 from django.views.generic import CreateView, DeleteView, DetailView, ListView
 
+from accounts.mixins import AsyncLoginRequiredMixin
+from mysite import caching
+from mysite.conditional import ConditionalGetMixin
+from mysite.routers import ReplicaReadMixin
+
+from . import likes, search, timeline
 from .forms import TweetForm
-from .models import Like, Tweet
+from .models import TimelineEntry, Tweet
+from .pagination import CursorPaginationMixin, InvalidCursor
 
 
-class HomeView(LoginRequiredMixin, ListView):
+class HomeView(LoginRequiredMixin, ReplicaReadMixin, ConditionalGetMixin, CursorPaginationMixin, ListView):
     model = Tweet
     template_name = "tweets/home.html"
-    queryset = Tweet.objects.select_related("user").prefetch_related("liked_tweet")
+    context_object_name = "tweet_list"
+    paginator_class = timeline.TimelinePaginator
+    paginate_by = 20
+
+    def get_queryset(self):
+        return TimelineEntry.objects.filter(owner=self.request.user)
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        kwargs["celebrity_ids"] = timeline.celebrity_followee_ids(self.request.user)
+        return super().get_paginator(queryset, per_page, **kwargs)
+
+    def get_etag_parts(self):
+        # ページに載るツイートの ID だけを取得し，いいね数の変化はツイートのバージョンで判断する
+        paginator = self.get_paginator(self.get_queryset(), self.paginate_by)
+        try:
+            page = paginator.page_values(self.request.GET.get(self.cursor_kwarg), fields=())
+        except InvalidCursor:
+            return None
+        user_version = caching.get_version(caching.USER, self.request.user.pk)
+        tweet_versions = caching.get_versions(caching.TWEET, [tweet["id"] for tweet in page])
+        return [user_version, page.next_cursor, sorted(tweet_versions.items())]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["liked_tweet_ids"] = likes.liked_tweet_ids(self.request.user, context["tweet_list"])
+        likes.merge_pending_like_counts(context["tweet_list"])
+        return context
+
+
+class SearchView(LoginRequiredMixin, ReplicaReadMixin, ListView):
+    template_name = "tweets/search.html"
+    context_object_name = "tweet_list"
+    paginate_by = 20
+
+    def get_queryset(self):
+        return search.search_tweets(self.request.GET.get("q", ""))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["liked_list"] = (
-            Like.objects.select_related("tweet").filter(user=self.request.user).values_list("tweet", flat=True)
-        )
+        context["query"] = self.request.GET.get("q", "")
+        context["liked_tweet_ids"] = likes.liked_tweet_ids(self.request.user, context["tweet_list"])
+        likes.merge_pending_like_counts(context["tweet_list"])
         return context
 
 
@@ -28,23 +73,32 @@ class TweetCreateView(LoginRequiredMixin, CreateView):
     form_class = TweetForm
     success_url = reverse_lazy("tweets:home")
 
+    @transaction.atomic
     def form_valid(self, form):
+        # 保存時に post_save シグナルでフォロワーのタイムラインへ書き込まれる
         form.instance.user = self.request.user
         return super().form_valid(form)
 
 
-class TweetDetailView(LoginRequiredMixin, DetailView):
+class TweetDetailView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     template_name = "tweets/detail.html"
     model = Tweet
-    queryset = Tweet.objects.select_related("user").prefetch_related("liked_tweet")
+    queryset = Tweet.objects.select_related("user")
+
+    def get_etag_parts(self):
+        # 存在しない ID のバージョンをキャッシュに作らない
+        if not self.get_queryset().filter(pk=self.kwargs["pk"]).exists():
+            return None
+        # ツイートのバージョンはいいね・取り消しと削除で，閲覧者のバージョンは閲覧者のいいねで進む
+        return [
+            caching.get_version(caching.TWEET, self.kwargs["pk"]),
+            caching.get_version(caching.USER, self.request.user.pk),
+        ]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["liked_list"] = (
-            Like.objects.select_related("tweet")
-            .filter(tweet=self.object, user=self.request.user)
-            .values_list("tweet", flat=True)
-        )
+        context["liked_tweet_ids"] = likes.liked_tweet_ids(self.request.user, [self.object])
+        likes.merge_pending_like_counts([self.object])
         return context
 
 
@@ -57,16 +111,21 @@ class TweetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         return self.request.user == self.get_object().user
 
 
-class LikeView(LoginRequiredMixin, View):
-    def post(self, request, *args, **kwargs):
+async def aget_tweet_or_404(pk):
+    try:
+        return await Tweet.objects.aget(pk=pk)
+    except Tweet.DoesNotExist:
+        raise Http404("No Tweet matches the given query.")
+
+
+class LikeView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
         tweet_id = self.kwargs["pk"]
-        tweet = get_object_or_404(Tweet, pk=tweet_id)
-        user = self.request.user
-        Like.objects.get_or_create(tweet=tweet, user=user)
+        tweet = await aget_tweet_or_404(tweet_id)
+        like_count = await likes.alike(tweet, self.request.user)
         is_liked = True
         like_url = reverse("tweets:like", kwargs={"pk": tweet_id})
         unlike_url = reverse("tweets:unlike", kwargs={"pk": tweet_id})
-        like_count = tweet.liked_tweet.count()
         context = {
             "like_count": like_count,
             "tweet_id": tweet_id,
@@ -77,16 +136,50 @@ class LikeView(LoginRequiredMixin, View):
         return JsonResponse(context)
 
 
-class UnlikeView(LoginRequiredMixin, View):
+class LikeBatchView(LoginRequiredMixin, View):
+    """{"operations": [{"tweet_id": 1, "liked": true}, ...]} を受け取り，まとめていいね・取り消しを行う。"""
+
     def post(self, request, *args, **kwargs):
+        try:
+            payload = json.loads(request.body)["operations"]
+            # 重複を除く前の件数で上限を確かめ，上限を超える本文は解析しない
+            if isinstance(payload, list) and len(payload) > settings.LIKE_BATCH_MAX_OPERATIONS:
+                return JsonResponse({"error": "too many operations."}, status=400)
+            operations = self.parse_operations(payload)
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({"error": "invalid operations."}, status=400)
+
+        like_counts = likes.batch(self.request.user, operations)
+        context = {
+            "tweets": [
+                {"tweet_id": tweet_id, "like_count": like_count, "is_liked": operations[tweet_id]}
+                for tweet_id, like_count in like_counts.items()
+            ],
+            "not_found": [tweet_id for tweet_id in operations if tweet_id not in like_counts],
+        }
+        return JsonResponse(context)
+
+    def parse_operations(self, payload):
+        # 同じツイートへの操作が複数ある場合は最後の操作だけを反映する
+        if not isinstance(payload, list):
+            raise ValueError(payload)
+        operations = {}
+        for operation in payload:
+            tweet_id, liked = operation["tweet_id"], operation["liked"]
+            if type(tweet_id) is not int or not isinstance(liked, bool):
+                raise ValueError(operation)
+            operations[tweet_id] = liked
+        return operations
+
+
+class UnlikeView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
         tweet_id = self.kwargs["pk"]
-        tweet = get_object_or_404(Tweet, pk=tweet_id)
-        user = self.request.user
-        Like.objects.filter(user=user, tweet=tweet).delete()  # 該当するLike.objectsが存在する場合のみdelete
+        tweet = await aget_tweet_or_404(tweet_id)
+        like_count = await likes.aunlike(tweet, self.request.user)  # 該当するLike.objectsが存在する場合のみdelete
         is_liked = False
         like_url = reverse("tweets:like", kwargs={"pk": tweet_id})
         unlike_url = reverse("tweets:unlike", kwargs={"pk": tweet_id})
-        like_count = tweet.liked_tweet.count()
         context = {
             "like_count": like_count,
             "tweet_id": tweet_id,